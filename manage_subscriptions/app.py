@@ -2,14 +2,56 @@ import json
 import logging
 import ses
 import commands
+import dynamo
+import geocode
+import http_client
+import templates
+import weather
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def admin_profile_update(event: dict) -> dict:
+    """
+    Applies an operator's change to one profile, given as
+    {"setPriority": {"email", "priority"}} or
+    {"setActive": {"email", "active"}}.
+    """
+    if "setPriority" in event:
+        change = event["setPriority"]
+        update, flag = dynamo.set_user_priority, bool(change.get("priority", True))
+    else:
+        change = event["setActive"]
+        update, flag = dynamo.set_user_active, bool(change.get("active", True))
+
+    email = (change.get("email") or "").strip()
+    if not email or not dynamo.user_exists(email):
+        logger.error(f"Admin update for unknown profile: {change}")
+        return {"statusCode": 404}
+
+    update(email, flag)
+    return {"statusCode": 200, "email": email}
+
+
 def lambda_handler(event, context):
     logger.info("ManageSubscriptionsFunction invoked")
     logger.info(event)
+    http_client.stats.reset()
+
+    # One-off backfill of the legacy PROFILE partition, invoked by hand
+    if event.get("migrateProfiles"):
+        return {"statusCode": 200, **dynamo.migrate_legacy_profiles()}
+    # One-off backfill of ActiveSubscribersIndex; dispatch reads the profiles
+    # directly until it has completed
+    if event.get("indexActiveProfiles"):
+        return {"statusCode": 200, **dynamo.index_active_profiles()}
+    # One-off backfill of SubscriptionIndex, needed before join mode is used
+    if event.get("indexSubscriptions"):
+        return {"statusCode": 200, **dynamo.index_subscriptions()}
+    # Operator changes to a profile, invoked by hand
+    if "setPriority" in event or "setActive" in event:
+        return admin_profile_update(event)
 
     # Unwrap SNS
     sns_record = event["Records"][0]["Sns"]
@@ -32,4 +74,9 @@ def lambda_handler(event, context):
     # Send response email
     ses.send_resp_email(results, email_content.sender_email)
 
+    geocode.geocodes.log_stats()
+    weather.forecasts.log_stats()
+    templates.fragments.log_stats()
+    logger.info(f"HTTP latency: {http_client.stats.snapshot()}")
+
     return {"statusCode": 200}
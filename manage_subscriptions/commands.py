@@ -49,8 +49,10 @@ def execute_commands(sender_email: str, commands: list[tuple[str, str]]):
     for command, payload in commands:
         try:
             if command == "ADD":
-                lat, lon = geocode.resolve_city(payload)
-                city, state = dynamo.add_city(sender_email, payload, lat, lon)
+                lat, lon, timezone = geocode.resolve_city(payload)
+                city, state = dynamo.add_city(
+                    sender_email, payload, lat, lon, timezone
+                )
                 if city and state:
                     results["added"].append({"city": city, "state": state})
 
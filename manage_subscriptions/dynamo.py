@@ -1,4 +1,5 @@
 import boto3
+import hashlib
 import os
 import logging
 from datetime import datetime
@@ -9,12 +10,60 @@ logger = logging.getLogger(__name__)
 dynamodb = boto3.client("dynamodb")
 DYNAMO_TABLE = os.environ.get("DYNAMO_TABLE_NAME")
 
+PROFILE_SHARD_COUNT = int(os.environ.get("PROFILE_SHARD_COUNT", "16"))
+# While true, profiles still under the legacy single "PROFILE" partition are
+# found by lookups alongside the sharded ones.
+PROFILE_SHARD_MIGRATION = (
+    os.environ.get("PROFILE_SHARD_MIGRATION", "false").lower() == "true"
+)
+LEGACY_PROFILE_PK = "PROFILE"
+PRIORITY_ACTIVE_PK = "ACTIVE#PRIORITY"
+# Written once every active profile carries its index keys; until then the
+# dispatcher reads the profile partitions instead of ActiveSubscribersIndex
+ACTIVE_INDEX_MARKER_KEY = {"PK": {"S": "MIGRATION"}, "SK": {"S": "ACTIVE_INDEX"}}
+# Send-time bucket of profiles whose timezone is not known yet
+DEFAULT_TIMEZONE = os.environ.get("DEFAULT_TIMEZONE", "America/New_York")
+# Tries of a REMOVE whose LOCATION count changed concurrently
+REGISTRY_ATTEMPTS = 3
+
 
 def deserialize_item(item):
     deserializer = TypeDeserializer()
     return {k: deserializer.deserialize(v) for k, v in item.items()}
 
 
+def profile_shard(email: str) -> str:
+    """
+    Returns the zero-padded shard suffix for an email, e.g. '07'.
+    The hash is stable across containers and deployments.
+    """
+    digest = hashlib.md5(email.lower().encode("utf-8")).hexdigest()
+    return f"{int(digest, 16) % PROFILE_SHARD_COUNT:02d}"
+
+
+def profile_pk(email: str) -> str:
+    return f"PROFILE#{profile_shard(email)}"
+
+
+def active_pk(email: str, priority: bool = False) -> str:
+    """
+    Partition key of the sparse ActiveSubscribersIndex. Only active profiles
+    carry it, so the dispatcher never reads inactive users. High-priority
+    profiles share one partition the dispatcher reads before the shards.
+    """
+    if priority:
+        return PRIORITY_ACTIVE_PK
+    return f"ACTIVE#{profile_shard(email)}"
+
+
+def active_sk(email: str, timezone: str | None) -> str:
+    """
+    Sort key of the ActiveSubscribersIndex. Prefixed with the subscriber's
+    timezone so the dispatcher can read one send-time bucket at a time.
+    """
+    return f"{timezone or DEFAULT_TIMEZONE}#{email}"
+
+
 def get_or_create_user(email: str) -> bool:
     """
     Returns True if user was created, False if already existed.
@@ -26,31 +75,422 @@ def get_or_create_user(email: str) -> bool:
     return True
 
 
+def get_profile(email: str) -> tuple[dict, dict] | tuple[None, None]:
+    """
+    Returns (key, item) of the email's profile, or (None, None) if there is
+    none. Checks the legacy PROFILE partition too while in migration mode.
+    """
+    candidates = [profile_pk(email)]
+    if PROFILE_SHARD_MIGRATION:
+        candidates.append(LEGACY_PROFILE_PK)
+
+    for pk in candidates:
+        key = {"PK": {"S": pk}, "SK": {"S": f"PROFILE#{email}"}}
+        response = dynamodb.get_item(
+            TableName=DYNAMO_TABLE,
+            Key=key,
+            ProjectionExpression="PK, #tz, isActive, priority",
+            ExpressionAttributeNames={"#tz": "timezone"},
+        )
+        if "Item" not in response:
+            continue
+        if pk == LEGACY_PROFILE_PK and migrate_profile(email):
+            return get_profile(email)
+        return key, response["Item"]
+
+    return None, None
+
+
+def migrate_profile(email: str) -> bool:
+    """
+    Moves a profile from the legacy PROFILE partition into its shard in one
+    transaction. An active profile gets both index keys recomputed, so it is
+    in ActiveSubscribersIndex even if it never was before. Returns
+    False if it could not be moved; the legacy item is then left as it is
+    and still found in migration mode.
+    """
+    legacy_key = {"PK": {"S": LEGACY_PROFILE_PK}, "SK": {"S": f"PROFILE#{email}"}}
+    item = dynamodb.get_item(
+        TableName=DYNAMO_TABLE, Key=legacy_key, ConsistentRead=True
+    ).get("Item")
+    if item is None:
+        return False
+
+    item = {**item, "PK": {"S": profile_pk(email)}}
+    if item.get("isActive", {}).get("BOOL", False):
+        item["activePK"] = {
+            "S": active_pk(email, item.get("priority", {}).get("BOOL", False))
+        }
+        item["activeSK"] = {"S": active_sk(email, item.get("timezone", {}).get("S"))}
+
+    try:
+        dynamodb.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "TableName": DYNAMO_TABLE,
+                        "Item": item,
+                        "ConditionExpression": "attribute_not_exists(PK)",
+                    }
+                },
+                {
+                    "Delete": {
+                        "TableName": DYNAMO_TABLE,
+                        "Key": legacy_key,
+                        "ConditionExpression": "attribute_exists(PK)",
+                    }
+                },
+            ]
+        )
+    except dynamodb.exceptions.TransactionCanceledException:
+        logger.exception(f"Failed to migrate the legacy profile of {email}")
+        return False
+
+    logger.info(f"Migrated the legacy profile of {email} to {profile_pk(email)}")
+    return True
+
+
+def migrate_legacy_profiles() -> dict:
+    """
+    Moves every profile left in the legacy PROFILE partition into its
+    shard. Safe to run again; profiles moved meanwhile are skipped.
+    """
+    migrated = failed = 0
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+        "ExpressionAttributeValues": {
+            ":pk": {"S": LEGACY_PROFILE_PK},
+            ":sk": {"S": "PROFILE#"},
+        },
+        "ProjectionExpression": "SK",
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        for item in response.get("Items", []):
+            if migrate_profile(item["SK"]["S"].removeprefix("PROFILE#")):
+                migrated += 1
+            else:
+                failed += 1
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    logger.info(f"Migrated {migrated} legacy profiles, {failed} failed")
+    return {"migrated": migrated, "failed": failed}
+
+
+def index_active_profiles() -> dict:
+    """
+    Brings the index keys of every active profile in line with the current
+    ActiveSubscribersIndex scheme, in the shards and the legacy PROFILE
+    partition. Profiles written before the index get both keys. Entries
+    from before the timezone buckets, with a bare-email activeSK or the
+    unsharded ACTIVE partition, are rewritten. Once none failed it writes
+    the marker that switches the dispatcher over to the index. Safe to run
+    again.
+    """
+    indexed = failed = 0
+    partitions = [f"PROFILE#{shard:02d}" for shard in range(PROFILE_SHARD_COUNT)]
+    partitions.append(LEGACY_PROFILE_PK)
+
+    for partition in partitions:
+        params = {
+            "TableName": DYNAMO_TABLE,
+            "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+            "FilterExpression": "isActive = :active",
+            "ExpressionAttributeValues": {
+                ":pk": {"S": partition},
+                ":sk": {"S": "PROFILE#"},
+                ":active": {"BOOL": True},
+            },
+            "ProjectionExpression": "PK, SK, #tz, priority, activePK, activeSK",
+            "ExpressionAttributeNames": {"#tz": "timezone"},
+        }
+
+        while True:
+            response = dynamodb.query(**params)
+            for item in response.get("Items", []):
+                email = item["SK"]["S"].removeprefix("PROFILE#")
+                priority = item.get("priority", {}).get("BOOL", False)
+                timezone = item.get("timezone", {}).get("S")
+                keys = {
+                    "activePK": {"S": active_pk(email, priority)},
+                    "activeSK": {"S": active_sk(email, timezone)},
+                }
+                if all(item.get(name) == value for name, value in keys.items()):
+                    continue
+
+                # Only if the keys are still the ones read, so a concurrent
+                # change of timezone, priority or isActive wins
+                condition = ["isActive = :active"]
+                values = {":pk": keys["activePK"], ":sk": keys["activeSK"], ":active": {"BOOL": True}}
+                for name in keys:
+                    if name in item:
+                        condition.append(f"{name} = :old_{name}")
+                        values[f":old_{name}"] = item[name]
+                    else:
+                        condition.append(f"attribute_not_exists({name})")
+                try:
+                    dynamodb.update_item(
+                        TableName=DYNAMO_TABLE,
+                        Key={"PK": item["PK"], "SK": item["SK"]},
+                        UpdateExpression="SET activePK = :pk, activeSK = :sk",
+                        ConditionExpression=" AND ".join(condition),
+                        ExpressionAttributeValues=values,
+                    )
+                except dynamodb.exceptions.ConditionalCheckFailedException:
+                    # Deactivated, moved or re-keyed meanwhile
+                    continue
+                except Exception:
+                    logger.exception(f"Failed to index the profile of {email}")
+                    failed += 1
+                    continue
+                indexed += 1
+
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if not failed:
+        dynamodb.put_item(
+            TableName=DYNAMO_TABLE,
+            Item={**ACTIVE_INDEX_MARKER_KEY, "completedAt": {"S": datetime.now().isoformat()}},
+        )
+
+    logger.info(f"Indexed {indexed} active profiles, {failed} failed")
+    return {"indexed": indexed, "failed": failed}
+
+
+def find_profile_key(email: str) -> dict | None:
+    key, _ = get_profile(email)
+    return key
+
+
 def user_exists(email: str) -> bool:
-    response = dynamodb.get_item(
-        TableName=DYNAMO_TABLE,
-        Key={"PK": {"S": "PROFILE"}, "SK": {"S": f"PROFILE#{email}"}},
-    )
-    print("RESPONSE: ", response)
-    return "Item" in response
+    return find_profile_key(email) is not None
 
 
 def create_user(email: str):
     dynamodb.put_item(
         TableName=DYNAMO_TABLE,
         Item={
-            "PK": {"S": "PROFILE"},
+            "PK": {"S": profile_pk(email)},
             "SK": {"S": f"PROFILE#{email}"},
             "email": {"S": email},
             "createdAt": {"S": datetime.now().isoformat()},
             "isActive": {"BOOL": True},
+            "activePK": {"S": active_pk(email)},
+            "activeSK": {"S": active_sk(email, None)},
         },
         ConditionExpression="attribute_not_exists(PK)",
     )
     return
 
 
-def add_city(email, payload, lat, lon):
+def set_user_active(email: str, is_active: bool):
+    """
+    Flips isActive and keeps the sparse ActiveSubscribersIndex in sync in the
+    same write. Deactivated profiles drop out of the index.
+    """
+    key, profile = get_profile(email)
+    if key is None:
+        logger.error(f"No profile found for {email}")
+        return
+
+    if is_active:
+        timezone = profile.get("timezone", {}).get("S")
+        priority = profile.get("priority", {}).get("BOOL", False)
+        dynamodb.update_item(
+            TableName=DYNAMO_TABLE,
+            Key=key,
+            UpdateExpression="SET isActive = :active, activePK = :pk, activeSK = :sk",
+            ExpressionAttributeValues={
+                ":active": {"BOOL": True},
+                ":pk": {"S": active_pk(email, priority)},
+                ":sk": {"S": active_sk(email, timezone)},
+            },
+            ConditionExpression="attribute_exists(PK)",
+        )
+    else:
+        dynamodb.update_item(
+            TableName=DYNAMO_TABLE,
+            Key=key,
+            UpdateExpression="SET isActive = :active REMOVE activePK, activeSK",
+            ExpressionAttributeValues={":active": {"BOOL": False}},
+            ConditionExpression="attribute_exists(PK)",
+        )
+
+    logger.info(f"Set isActive={is_active} for {email}")
+
+
+def set_user_priority(email: str, priority: bool):
+    """
+    Moves a profile in or out of the priority lane. Active profiles change
+    index partition in the same write, so the dispatcher reads them first.
+    """
+    key, profile = get_profile(email)
+    if key is None:
+        logger.error(f"No profile found for {email}")
+        return
+
+    values = {":priority": {"BOOL": priority}}
+    update = "SET priority = :priority"
+    if profile.get("isActive", {}).get("BOOL", False):
+        update += ", activePK = :pk"
+        values[":pk"] = {"S": active_pk(email, priority)}
+
+    dynamodb.update_item(
+        TableName=DYNAMO_TABLE,
+        Key=key,
+        UpdateExpression=update,
+        ExpressionAttributeValues=values,
+        ConditionExpression="attribute_exists(PK)",
+    )
+
+    logger.info(f"Set priority={priority} for {email}")
+
+
+def set_user_timezone(email: str, timezone: str):
+    """
+    Stores the subscriber's IANA timezone the first time one is known and
+    moves the profile into that send-time bucket of the index. Later ADDs
+    in other timezones do not move an existing subscriber's send time.
+    """
+    key = find_profile_key(email)
+    if key is None:
+        logger.error(f"No profile found for {email}")
+        return
+
+    # Registry of every timezone in use, read by the dispatcher each hour
+    dynamodb.put_item(
+        TableName=DYNAMO_TABLE,
+        Item={"PK": {"S": "TIMEZONE"}, "SK": {"S": timezone}},
+    )
+
+    try:
+        dynamodb.update_item(
+            TableName=DYNAMO_TABLE,
+            Key=key,
+            UpdateExpression="SET #tz = :tz, activeSK = :sk",
+            ConditionExpression="attribute_exists(PK) AND attribute_not_exists(#tz)",
+            ExpressionAttributeNames={"#tz": "timezone"},
+            ExpressionAttributeValues={
+                ":tz": {"S": timezone},
+                ":sk": {"S": active_sk(email, timezone)},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return
+
+    # Cities added before the timezone was known were recorded as default
+    try:
+        note_subscriber_timezone(email, timezone)
+    except Exception:
+        logger.exception(f"Failed to record timezone {timezone} on the locations of {email}")
+
+    logger.info(f"Set timezone {timezone} for {email}")
+
+
+def subscription_pk(email: str) -> str:
+    """
+    Partition key of the sparse SubscriptionIndex, which holds only the
+    subscription items, sharded like the profiles. Join mode reads it
+    instead of scanning the whole table.
+    """
+    return f"SUBS#{profile_shard(email)}"
+
+
+def index_subscriptions() -> dict:
+    """
+    Backfills subsPK on subscription items written before SubscriptionIndex
+    existed. Scans the table once; safe to run again.
+    """
+    indexed = 0
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "FilterExpression": "begins_with(PK, :pk) AND attribute_not_exists(subsPK)",
+        "ExpressionAttributeValues": {":pk": {"S": "SUBSCRIPTION#"}},
+        "ProjectionExpression": "PK, SK",
+    }
+
+    while True:
+        response = dynamodb.scan(**params)
+        for item in response.get("Items", []):
+            email = item["PK"]["S"].removeprefix("SUBSCRIPTION#")
+            try:
+                dynamodb.update_item(
+                    TableName=DYNAMO_TABLE,
+                    Key={"PK": item["PK"], "SK": item["SK"]},
+                    UpdateExpression="SET subsPK = :subs",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeValues={":subs": {"S": subscription_pk(email)}},
+                )
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                continue
+            indexed += 1
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    logger.info(f"Indexed {indexed} subscriptions")
+    return {"indexed": indexed}
+
+
+def location_key(country: str, state: str, city: str) -> str:
+    return f"LOC#{country}#{state.upper()}#{city.upper()}"
+
+
+def send_timezone(email: str, timezone: str | None) -> str:
+    """
+    Returns the timezone the subscriber's forecast is sent in once an ADD
+    with `timezone` is stored: the profile's own if it has one, the new
+    city's otherwise, and the default bucket if neither is known.
+    """
+    _, profile = get_profile(email)
+    if profile and "timezone" in profile:
+        return profile["timezone"]["S"]
+    return timezone or DEFAULT_TIMEZONE
+
+
+def note_subscriber_timezone(email: str, timezone: str):
+    """
+    Adds a subscriber's new send timezone to the LOCATION item of every city
+    it already follows, which were recorded under the default bucket.
+    """
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk",
+        "ExpressionAttributeValues": {":pk": {"S": f"SUBSCRIPTION#{email}"}},
+        "ProjectionExpression": "SK",
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        for item in response.get("Items", []):
+            try:
+                dynamodb.update_item(
+                    TableName=DYNAMO_TABLE,
+                    Key={
+                        "PK": {"S": "LOCATION"},
+                        "SK": {"S": "LOC#" + item["SK"]["S"].removeprefix("SUB#")},
+                    },
+                    UpdateExpression="ADD subscriberTimezones :tz",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeValues={":tz": {"SS": [timezone]}},
+                )
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                continue
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def add_city(email, payload, lat, lon, timezone=None):
     try:
         city, state = [x.strip() for x in payload.split(",")]
     except ValueError:
@@ -66,14 +506,157 @@ def add_city(email, payload, lat, lon):
         "lon": {"N": str(lon)},
         "country": {"S": "US"},
         "createdAt": {"S": datetime.now().isoformat()},
+        "subsPK": {"S": subscription_pk(email)},
     }
+    if timezone:
+        item["timezone"] = {"S": timezone}
 
-    dynamodb.put_item(TableName=DYNAMO_TABLE, Item=item)
+    # Only a new subscription adds to the location's subscriber count
+    is_new = "Item" not in dynamodb.get_item(
+        TableName=DYNAMO_TABLE,
+        Key={"PK": item["PK"], "SK": item["SK"]},
+        ProjectionExpression="PK",
+        ConsistentRead=True,
+    )
+
+    loc_key = location_key("US", state, city)
+    location_set = "SET city = :city, #state = :state, country = :country, lat = :lat, lon = :lon"
+    location_add = "ADD subscriberTimezones :send_tz"
+    location_names = {"#state": "state"}
+    location_values = {
+        ":city": {"S": city},
+        ":state": {"S": state},
+        ":country": {"S": "US"},
+        ":lat": {"N": str(lat)},
+        ":lon": {"N": str(lon)},
+        ":send_tz": {"SS": [send_timezone(email, timezone)]},
+    }
+    if timezone:
+        location_set += ", #tz = :tz"
+        location_names["#tz"] = "timezone"
+        location_values[":tz"] = {"S": timezone}
+    if is_new:
+        location_add += ", subscribers :one"
+        location_values[":one"] = {"N": "1"}
+
+    # Subscription and reverse index entry are written together. The LOCATION
+    # item collects the send timezones of its subscribers, so the dispatcher
+    # can skip locations with no subscriber due in the current run. The
+    # subscription's condition fails the write if a concurrent ADD of the
+    # same city got there first, so the count cannot drift.
+    dynamodb.transact_write_items(
+        TransactItems=[
+            {
+                "Put": {
+                    "TableName": DYNAMO_TABLE,
+                    "Item": item,
+                    "ConditionExpression": (
+                        "attribute_not_exists(PK)" if is_new else "attribute_exists(PK)"
+                    ),
+                }
+            },
+            {
+                "Update": {
+                    "TableName": DYNAMO_TABLE,
+                    "Key": {"PK": {"S": "LOCATION"}, "SK": {"S": loc_key}},
+                    "UpdateExpression": f"{location_set} {location_add}",
+                    "ExpressionAttributeNames": location_names,
+                    "ExpressionAttributeValues": location_values,
+                }
+            },
+            {
+                "Put": {
+                    "TableName": DYNAMO_TABLE,
+                    "Item": {
+                        "PK": {"S": loc_key},
+                        "SK": {"S": f"SUB#{email}"},
+                        "email": {"S": email},
+                    },
+                }
+            },
+        ]
+    )
+
+    if timezone:
+        set_user_timezone(email, timezone)
 
     logger.info(f"Added city {city}, {state} for {email}")
     return city, state
 
 
+def count_location_subscribers(loc_key: str) -> int:
+    """
+    Counts the reverse index entries of a location, for LOCATION items
+    written before add_city kept a count.
+    """
+    count = 0
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+        "ExpressionAttributeValues": {":pk": {"S": loc_key}, ":sk": {"S": "SUB#"}},
+        "Select": "COUNT",
+        "ConsistentRead": True,
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        count += response["Count"]
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return count
+
+
+def location_registry_release(loc_key: str) -> dict | None:
+    """
+    Returns the transaction item that takes one subscriber off the LOCATION
+    registry entry: a decrement, or a delete when it is the last one, so
+    the dispatcher stops fetching forecasts nobody receives. Conditioned on
+    the count read, so a concurrent ADD or REMOVE cancels the transaction.
+    None if there is no registry entry.
+    """
+    key = {"PK": {"S": "LOCATION"}, "SK": {"S": loc_key}}
+    location = dynamodb.get_item(
+        TableName=DYNAMO_TABLE,
+        Key=key,
+        ProjectionExpression="subscribers",
+        ConsistentRead=True,
+    ).get("Item")
+    if location is None:
+        return None
+
+    if "subscribers" in location:
+        count = int(location["subscribers"]["N"])
+        condition = "subscribers = :count"
+        values = {":count": {"N": str(count)}}
+    else:
+        # The reverse index entry being removed is still counted
+        count = count_location_subscribers(loc_key)
+        condition = "attribute_not_exists(subscribers)"
+        values = {}
+
+    if count <= 1:
+        return {
+            "Delete": {
+                "TableName": DYNAMO_TABLE,
+                "Key": key,
+                "ConditionExpression": condition,
+                **({"ExpressionAttributeValues": values} if values else {}),
+            }
+        }
+    return {
+        "Update": {
+            "TableName": DYNAMO_TABLE,
+            "Key": key,
+            "UpdateExpression": "SET subscribers = :left",
+            "ConditionExpression": condition,
+            "ExpressionAttributeValues": {**values, ":left": {"N": str(count - 1)}},
+        }
+    }
+
+
 def remove_city(email, payload):
     try:
         city, state = [x.strip() for x in payload.split(",")]
@@ -81,13 +664,50 @@ def remove_city(email, payload):
         logger.error(f"Invalid REMOVE payload: {payload}")
         return None, None
 
-    dynamodb.delete_item(
-        TableName=DYNAMO_TABLE,
-        Key={
-            "PK": {"S": f"SUBSCRIPTION#{email}"},
-            "SK": {"S": f"SUB#US#{state.upper()}#{city.upper()}"},
-        },
-    )
+    subscription_key = {
+        "PK": {"S": f"SUBSCRIPTION#{email}"},
+        "SK": {"S": f"SUB#US#{state.upper()}#{city.upper()}"},
+    }
+    loc_key = location_key("US", state, city)
+
+    # A concurrent change to the same location cancels the transaction, and
+    # the count is read again
+    for attempt in range(REGISTRY_ATTEMPTS):
+        if "Item" not in dynamodb.get_item(
+            TableName=DYNAMO_TABLE,
+            Key=subscription_key,
+            ProjectionExpression="PK",
+            ConsistentRead=True,
+        ):
+            logger.info(f"{email} is not subscribed to {city}, {state}")
+            return city, state
+
+        transact_items = [
+            {
+                "Delete": {
+                    "TableName": DYNAMO_TABLE,
+                    "Key": subscription_key,
+                    "ConditionExpression": "attribute_exists(PK)",
+                }
+            },
+            {
+                "Delete": {
+                    "TableName": DYNAMO_TABLE,
+                    "Key": {"PK": {"S": loc_key}, "SK": {"S": f"SUB#{email}"}},
+                }
+            },
+        ]
+        release = location_registry_release(loc_key)
+        if release is not None:
+            transact_items.append(release)
+
+        try:
+            dynamodb.transact_write_items(TransactItems=transact_items)
+            break
+        except dynamodb.exceptions.TransactionCanceledException:
+            if attempt == REGISTRY_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Location {loc_key} changed while removing {email}, retrying")
 
     logger.info(f"Removed city {city}, {state} for {email}")
     return city, state
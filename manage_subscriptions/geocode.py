@@ -1,7 +1,13 @@
-import requests
+import os
+import http_client
 import constants
+import local_cache
 
 GEOCODE_URL = "https://geocoding-api.open-meteo.com/v1/search"
+# Places barely move, so resolved cities are kept for a long time
+GEOCODE_CACHE_DAYS = float(os.environ.get("GEOCODE_CACHE_DAYS", "30"))
+
+geocodes = local_cache.LocalCache("geocodes", GEOCODE_CACHE_DAYS * 86400)
 
 
 class GeocodeError(Exception):
@@ -33,7 +39,7 @@ def _parse_city_state(payload: str) -> tuple[str, str]:
 def resolve_city(payload: str, country: str = "US"):
     """
     Resolves a city/state string (e.g. 'Charlotte, NC') to lat/lon using Open-Meteo.
-    Returns: (city, state, lat, lon)
+    Returns: (lat, lon, timezone)
 
 
     GEOCODE RESULTS:  [{'id': 4460243, 'name': 'Charlotte', 'latitude': 35.22709, 'longitude': -80.84313, 'elevation': 229.0, 'feature_code': 'PPLA2', 'country_code': 'US',
@@ -43,6 +49,11 @@ def resolve_city(payload: str, country: str = "US"):
 
     city, state = _parse_city_state(payload)
 
+    cache_key = f"{country}#{state}#{city.upper()}"
+    cached = geocodes.get(cache_key)
+    if cached is not None:
+        return tuple(cached)
+
     params = {
         "name": city,
         "country": country,
@@ -51,8 +62,7 @@ def resolve_city(payload: str, country: str = "US"):
         "format": "json",
     }
 
-    response = requests.get(GEOCODE_URL, params=params, timeout=10)
-    response.raise_for_status()
+    response = http_client.get(GEOCODE_URL, params=params)
 
     data = response.json()
     results = data.get("results")
@@ -78,4 +88,6 @@ def resolve_city(payload: str, country: str = "US"):
     if lat is None or lon is None:
         raise GeocodeError(f"Geocoding result missing lat/lon for '{payload}'")
 
-    return lat, lon
+    result = (lat, lon, match.get("timezone"))
+    geocodes.set(cache_key, result)
+    return result
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LOCAL_CACHE_DIR = os.environ.get("LOCAL_CACHE_DIR", "/tmp")
+LOCAL_CACHE_MAX_ENTRIES = int(os.environ.get("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+# Expired rows are purged from disk once every this many writes
+PURGE_EVERY = 100
+
+
+class LocalCache:
+    """
+    Two-tier cache that lives as long as the Lambda container: a size-bounded
+    in-memory LRU in front of a SQLite file in /tmp. Entries expire after
+    `ttl_seconds` in both tiers. Values must be JSON-serializable and not
+    None. If the disk tier cannot be used the cache carries on in memory.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_entries: int = LOCAL_CACHE_MAX_ENTRIES,
+        directory: str = LOCAL_CACHE_DIR,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.writes = 0
+        self.db = self._open(os.path.join(directory, f"{name}.sqlite"))
+
+    def _open(self, path: str) -> sqlite3.Connection | None:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            db.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            return db
+        except sqlite3.Error:
+            logger.exception(f"Local cache {self.name}: disk tier disabled")
+            return None
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+
+            value, expires_at = self._disk_get(key, now)
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["disk_hits"] += 1
+            self._memory_set(key, value, expires_at)
+            return value
+
+    def set(self, key: str, value):
+        if value is None:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            self._memory_set(key, value, expires_at)
+            self._disk_set(key, value, expires_at)
+
+    def log_stats(self):
+        with self.lock:
+            logger.info(
+                f"Local cache {self.name}: {len(self.memory)} in memory, {self.stats}"
+            )
+
+    def _memory_set(self, key: str, value, expires_at: float):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_get(self, key: str, now: float):
+        if self.db is None:
+            return None, None
+        try:
+            row = self.db.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+        except sqlite3.Error:
+            logger.exception(f"Local cache {self.name}: disk read failed")
+            return None, None
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, value, expires_at: float):
+        if self.db is None:
+            return
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, separators=(",", ":")), expires_at),
+            )
+            self.writes += 1
+            if self.writes % PURGE_EVERY == 0:
+                self.db.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error:
+            logger.exception(f"Local cache {self.name}: disk write failed")
@@ -4,8 +4,8 @@ import re
 import logging
 from dataclasses import dataclass
 import boto3
+import templates
 import weather
-import constants
 
 logger = logging.getLogger(__name__)
 
@@ -98,98 +98,96 @@ def exec_send_email(email: str, subject: str, body: str):
     )
 
 
+INTRO = templates.Template(
+    "Hello, here are the results of your subscription commands:\n\n"
+)
+ADDED = templates.Template("✅ Added the following subscriptions:\n")
+REMOVED = templates.Template("❌ Removed the following subscriptions:\n")
+LISTED = templates.Template(
+    "📍 You are currently subscribed to the following locations:\n"
+)
+FORECASTS = templates.Template("🌤 Detailed Forecast:\n\n")
+ERRORS = templates.Template("⚠️ Some commands could not be processed:\n")
+ITEM = templates.Template("  - {city}, {state}\n")
+ERROR = templates.Template("  - {command} {payload} — {error}\n")
+FOOTER = templates.Template(
+    "----------------------------\n"
+    "Manage your subscriptions\n"
+    "----------------------------\n"
+    "\n"
+    "Send an email to:\n"
+    "weather@inbound.geistdevelopment.com\n"
+    "\n"
+    "One command per line in the body:\n"
+    "ADD Charlotte, NC\n"
+    "REMOVE Raleigh, NC\n"
+    "LIST\n"
+    "\n"
+    "----------------------------\n"
+    "\n"
+    "— Wetter Bericht ☀️\n"
+    "This is an automated email. Do not reply."
+)
+
+
+def render_items(heading: templates.Template, items: list[dict]) -> str:
+    lines = "".join(
+        ITEM.render(city=item["city"], state=item["state"]) for item in items
+    )
+    return f"{heading.render()}{lines}\n"
+
+
 def send_resp_email(results: dict, to_email: str):
     """
     Builds and sends a subscription response email based on command execution results.
     """
 
-    lines = []
-    lines.append("Hello, here are the results of your subscription commands:")
-    lines.append("")
+    # FALLBACK
+    if (
+        not results["added"]
+        and not results["removed"]
+        and results["listed"] is None
+        and not results["errors"]
+    ):
+        return
+
+    parts = [INTRO.render()]
 
     # ADD RESULTS
     if results["added"]:
-        lines.append("✅ Added the following subscriptions:")
-        for item in results["added"]:
-            lines.append(f"  - {item['city']}, {item['state']}")
-        lines.append("")
+        parts.append(render_items(ADDED, results["added"]))
 
     # REMOVE RESULTS
     if results["removed"]:
-        lines.append("❌ Removed the following subscriptions:")
-        for item in results["removed"]:
-            lines.append(f"  - {item['city']}, {item['state']}")
-        lines.append("")
+        parts.append(render_items(REMOVED, results["removed"]))
 
     # LIST + WEATHER
     if results["listed"] is not None:
-        lines.append("📍 You are currently subscribed to the following locations:")
-        for item in results["listed"]:
-            lines.append(f"  - {item['city']}, {item['state']}")
-        lines.append("")
-
-        lines.append("🌤 Detailed Forecast:")
-        lines.append("")
+        parts.append(render_items(LISTED, results["listed"]))
+        parts.append(FORECASTS.render())
 
         for sub in results["listed"]:
             forecast = weather.fetch_weather(
                 lat=sub["lat"],
                 lon=sub["lon"],
             )
-
-            lines.append(f"- {sub['city']}, {sub['state']} ")
-
-            for idx, day in enumerate(forecast):
-                label = weather.format_day_label(day["date"], idx)
-                description = constants.WEATHER_CODE_MAP.get(
-                    day["code"], "Unknown Weather Code"
-                )
-                lines.append(
-                    f"  {label} {day['high']}°F / {day['low']}°F ({description})"
-                )
-
-            lines.append("")
+            # The same cached block as in the daily forecast email
+            parts.append(
+                templates.location_fragment(sub["city"], sub["state"], forecast)
+            )
 
     # ERRORS
     if results["errors"]:
-        lines.append("⚠️ Some commands could not be processed:")
-        for error in results["errors"]:
-            lines.append(
-                f"  - {error['command']} {error['payload']} — {error['error']}"
+        errors = "".join(
+            ERROR.render(
+                command=error["command"], payload=error["payload"], error=error["error"]
             )
-        lines.append("")
-
-    # FALLBACK
-    if (
-        not results["added"]
-        and not results["removed"]
-        and results["listed"] is None
-        and not results["errors"]
-    ):
-        return
+            for error in results["errors"]
+        )
+        parts.append(f"{ERRORS.render()}{errors}\n")
 
-    # FOOTER
-    footer = [
-        "----------------------------",
-        "Manage your subscriptions",
-        "----------------------------",
-        "",
-        "Send an email to:",
-        "weather@inbound.geistdevelopment.com",
-        "",
-        "One command per line in the body:",
-        "ADD Charlotte, NC",
-        "REMOVE Raleigh, NC",
-        "LIST",
-        "",
-        "----------------------------",
-        "",
-        "— Wetter Bericht ☀️",
-        "This is an automated email. Do not reply.",
-    ]
-    lines.extend(footer)
-
-    body = "\n".join(lines)
+    parts.append(FOOTER.render())
+    body = "".join(parts)
 
     exec_send_email(
         email=to_email,
@@ -197,4 +195,4 @@ def send_resp_email(results: dict, to_email: str):
         body=body,
     )
 
-    return "\n".join(lines)
+    return body
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from string import Formatter
+from daily_forecast import Forecast
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Rendered location blocks kept per container, a few hundred bytes each
+TEMPLATE_FRAGMENT_ENTRIES = int(os.environ.get("TEMPLATE_FRAGMENT_ENTRIES", "4096"))
+# Open-Meteo is asked for these units, so every cached block is in them
+UNITS = "fahrenheit"
+
+
+# The conversions a field may carry, as in "{value!r}"
+CONVERSIONS = {"s": str, "r": repr, "a": ascii}
+
+
+class Template:
+    """
+    A str.format template parsed once, when the module is loaded, so a typo
+    fails at import rather than on the first send. It keeps the parsed
+    literal text and fields and renders them with a join, without parsing
+    the source again. A template without fields is rendered once and its
+    text reused. Fields are plain names, as in "{city}" or "{high:.0f}".
+    """
+
+    __slots__ = ("source", "fields", "parts", "text")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if field is not None and (not field.isidentifier() or "{" in spec):
+                raise ValueError(f"Unsupported template field {field!r} in {source!r}")
+            self.parts.append(
+                (literal, field, spec or "", CONVERSIONS[conversion] if conversion else None)
+            )
+        self.parts = tuple(self.parts)
+        self.fields = tuple(field for _, field, _, _ in self.parts if field is not None)
+        self.text = None if self.fields else source.format()
+
+    def render(self, **values) -> str:
+        if self.text is not None:
+            return self.text
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion is not None:
+                value = conversion(value)
+            out.append(value if type(value) is str and not spec else format(value, spec))
+        return "".join(out)
+
+
+class FragmentCache:
+    """
+    Rendered fragments by key in a size-bounded LRU. An entry remembers what
+    it was rendered from, so a refreshed forecast under the same key is
+    rendered again instead of served from the old block.
+    """
+
+    def __init__(self, name: str, max_entries: int = TEMPLATE_FRAGMENT_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_or_render(self, key, source, render) -> str:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is source or entry[0] == source):
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+
+        text = render()
+        with self.lock:
+            self.stats["misses"] += 1
+            self.entries[key] = (source, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return text
+
+    def log_stats(self):
+        with self.lock:
+            logger.info(
+                f"Fragment cache {self.name}: {len(self.entries)} entries, {self.stats}"
+            )
+
+
+LOCATION = Template("- {city}, {state}\n{days}\n")
+DAY = Template("  {label} {high}°F / {low}°F ({description})\n")
+UNAVAILABLE = Template("  (Weather unavailable)\n")
+
+# Lives as long as the container, across warm invocations
+fragments = FragmentCache("locations")
+
+
+def render_location(city: str, state: str, forecast: Forecast) -> str:
+    days = "".join(
+        DAY.render(label=label, high=high, low=low, description=description)
+        for label, high, low, description in forecast.days()
+    )
+    return LOCATION.render(city=city, state=state, days=days or UNAVAILABLE.render())
+
+
+def location_fragment(
+    city: str, state: str, forecast: Forecast, units: str = UNITS
+) -> str:
+    """
+    The email block of one location: its name followed by a line per day.
+    Blocks are cached per (location, date, units), so subscribers sharing a
+    city share its rendered text.
+    """
+    if not forecast:
+        return render_location(city, state, forecast)
+    return fragments.get_or_render(
+        (city, state, forecast.dates[0], units),
+        forecast,
+        lambda: render_location(city, state, forecast),
+    )
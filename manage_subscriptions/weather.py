@@ -1,23 +1,37 @@
 import logging
-import requests
-from datetime import datetime
+import os
+import http_client
+from datetime import datetime, timezone
+import local_cache
+from daily_forecast import Forecast
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-
-def format_day_label(date_str: str, index: int) -> str:
-    if index == 0:
-        return "Today"
-    if index == 1:
-        return "Tomorrow"
-
-    dt = datetime.strptime(date_str, "%Y-%m-%d")
-    return dt.strftime("%A")
+LOCAL_FORECAST_CACHE_MINUTES = float(
+    os.environ.get("LOCAL_FORECAST_CACHE_MINUTES", "30")
+)
+
+forecasts = local_cache.LocalCache("forecasts", LOCAL_FORECAST_CACHE_MINUTES * 60)
+
+
+def fetch_weather(lat: float, lon: float) -> Forecast:
+    """
+    Returns the 7-day forecast of a location, from the container's cache
+    when it was fetched recently.
+    """
+    date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    cache_key = f"{round(float(lat), 2)}#{round(float(lon), 2)}#{date}"
+    cached = forecasts.get(cache_key)
+    if cached is not None:
+        return Forecast.load(cached)
+    forecast = _fetch_weather(lat, lon)
+    forecasts.set(cache_key, forecast.to_json())
+    return forecast
 
 
-def fetch_weather(lat: float, lon: float):
+def _fetch_weather(lat: float, lon: float) -> Forecast:
     url = "https://api.open-meteo.com/v1/forecast"
     params = {
         "latitude": lat,
@@ -29,25 +43,5 @@ def fetch_weather(lat: float, lon: float):
         "timezone": "auto",
     }
 
-    response = requests.get(url, params=params, timeout=10)
-    response.raise_for_status()
-    data = response.json()
-
-    daily = data.get("daily", {})
-    dates = daily.get("time", [])
-    highs = daily.get("temperature_2m_max", [])
-    lows = daily.get("temperature_2m_min", [])
-    codes = daily.get("weathercode", [])
-
-    forecast = []
-    for i in range(min(7, len(dates))):
-        forecast.append(
-            {
-                "date": dates[i],
-                "high": highs[i],
-                "low": lows[i],
-                "code": codes[i],
-            }
-        )
-
-    return forecast
+    response = http_client.get(url, params=params)
+    return Forecast.from_daily(response.json().get("daily", {}))
@@ -1,7 +1,11 @@
 import json
 import logging
+from datetime import datetime
 import dynamo
+import http_client
+from deadline import Deadline
 import ses
+import templates
 import weather
 
 
@@ -9,43 +13,172 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def lambda_handler(event, context):
-    logger.info("SendForecastFunction invoked via SNS")
-    try:
-        sns_record = event["Records"][0]["Sns"]
-        sns_message = json.loads(sns_record["Message"])
-        logger.info(f"SNS Message: {sns_message}")
-
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        logger.error(f"Invalid SNS event format: {e}")
-        return {"statusCode": 400, "body": f"SNS ERROR: {e}"}
+def parse_job(message: dict) -> tuple[str, list[str], dict[str, list[dict]]]:
+    """
+    Returns (runDate, emails, cities) of a job. Accepts a single-subscriber
+    job {"email", "runDate"}, an envelope {"subscribers", "runDate"} and a
+    hydrated job that also carries the subscriber's "cities".
+    """
+    run_dt = message.get("runDate") or datetime.strftime(datetime.now(), "%Y-%m-%d")
 
-    email = sns_message.get("email")
-    run_dt = sns_message.get("runDate")
+    if "subscribers" in message:
+        emails = [email for email in message["subscribers"] if email]
+    else:
+        emails = [message["email"]] if message.get("email") else []
 
-    if not email:
-        logger.error("SNS message missing 'email' field")
-        return {
-            "statusCode": 400,
-            "body": f"SNS ERROR: Missing email - got email={email}",
-        }
+    cities = {}
+    if "cities" in message and emails:
+        cities[emails[0]] = message["cities"]
 
-    logger.info(f"Processing forecast for {email} | runDate={run_dt}")
+    return run_dt, emails, cities
 
-    cities = dynamo.get_cities_for_subscriber(email)
-    logger.info(f"Subscriber {email} has {len(cities)} cities")
-    forecast_payload = weather.build_forecast_payload(cities)
 
+def send_forecast(
+    email: str, forecast_payload: list[dict], deadline: Deadline | None = None
+) -> str:
     body = ses.build_email_body(forecast_payload)
-    ses.send_email_to_subscriber(email, body)
+    ses.send_email_to_subscriber(email, body, deadline)
+    return "sent"
+
+
+def parse_record(record: dict) -> tuple[str, dict]:
+    """
+    Returns (id, job message) of one record. SQS records carry the job as
+    their raw body, or wrapped in an SNS notification without raw delivery.
+    Direct SNS records (local test events) are accepted too.
+    """
+    if "Sns" in record:
+        return record["Sns"]["MessageId"], json.loads(record["Sns"]["Message"])
+
+    body = json.loads(record["body"])
+    if body.get("Type") == "Notification" and "Message" in body:
+        body = json.loads(body["Message"])
+    return record["messageId"], body
+
+
+def process_jobs(
+    jobs: list[tuple[str, list[str], dict[str, list[dict]]]],
+    deadline: Deadline | None = None,
+) -> list[dict[str, str]]:
+    """
+    Sends the forecast to every subscriber of a batch of jobs, given as
+    (runDate, emails, hydrated cities), and returns a status per subscriber
+    for each job. One subscriber failing does not affect the others.
+    Subscribers whose cities came with the job skip DynamoDB, and the
+    weather of a city shared across the batch is fetched once. Lookups
+    and fetches stop short of the deadline, so the emails still go out,
+    with partial weather if it ran late.
+    """
+    results = [{} for _ in jobs]
+    cities_by_subscriber = {}
+    claimed = []
+
+    for idx, (run_dt, emails, hydrated) in enumerate(jobs):
+        # A repeated delivery costs one conditional write per subscriber
+        try:
+            job_claimed = dynamo.claim_ledgers(run_dt, emails)
+        except Exception as e:
+            # Throttled or timed out: only this job is retried. Claims it
+            # did take lapse with their lease before the redelivery.
+            logger.exception(f"Failed to claim the ledger of a job for runDate={run_dt}")
+            for email in emails:
+                results[idx][email] = f"error: {e}"
+            continue
+        for email in emails:
+            if email not in job_claimed:
+                logger.info(f"Forecast for {email} already sent for runDate={run_dt}")
+                results[idx][email] = "duplicate"
+
+        to_query = []
+        for email in job_claimed:
+            claimed.append((idx, run_dt, email))
+            if email in hydrated:
+                cities_by_subscriber[(idx, email)] = hydrated[email]
+            else:
+                to_query.append(email)
+
+        for email, cities in dynamo.get_cities_for_subscribers(to_query, deadline).items():
+            if isinstance(cities, Exception):
+                results[idx][email] = f"error: {cities}"
+                continue
+            logger.info(f"Subscriber {email} has {len(cities)} cities")
+            cities_by_subscriber[(idx, email)] = cities
+
+    payloads = weather.build_forecast_payloads(cities_by_subscriber, deadline)
+
+    def send(key):
+        _, email = key
+        try:
+            return send_forecast(email, payloads[key], deadline)
+        except Exception as e:
+            logger.exception(f"Failed to send forecast to {email}")
+            return f"error: {e}"
+
+    for (idx, email), status in zip(payloads, dynamo.executor.map(send, payloads)):
+        results[idx][email] = status
+
+    # Failed subscribers give their claim back so a redelivery can retry them.
+    # A claim left PENDING by a timeout lapses on its own.
+    for idx, run_dt, email in claimed:
+        if results[idx][email].startswith("error"):
+            dynamo.release_ledger(run_dt, email)
+    dynamo.complete_ledgers(
+        [(run_dt, email) for idx, run_dt, email in claimed if results[idx][email] == "sent"]
+    )
+
+    return results
+
+
+def lambda_handler(event, context):
+    deadline = Deadline.from_context(context)
+    http_client.stats.reset()
+    records = event.get("Records", [])
+    logger.info(f"SendForecastFunction invoked with {len(records)} jobs")
+
+    jobs = []
+    job_ids = []
+    failures = []
+    for record in records:
+        try:
+            record_id, message = parse_record(record)
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            logger.error(f"Invalid job record: {e}")
+            failures.append(record.get("messageId"))
+            continue
+
+        run_dt, emails, hydrated = parse_job(message)
+        if not emails:
+            logger.error(f"Job message missing 'email' or 'subscribers': {message}")
+            failures.append(record_id)
+            continue
+
+        jobs.append((run_dt, emails, hydrated))
+        job_ids.append(record_id)
+
+    subscribers = sum(len(emails) for _, emails, _ in jobs)
+    logger.info(f"Processing forecast for {subscribers} subscribers in {len(jobs)} jobs")
+    results = process_jobs(jobs, deadline)
+
+    sent = 0
+    for record_id, (run_dt, _, _), job_results in zip(job_ids, jobs, results):
+        sent += sum(status == "sent" for status in job_results.values())
+        failed = [
+            email for email, status in job_results.items() if status.startswith("error")
+        ]
+        # Only this job is redelivered; its sent subscribers are skipped then
+        if failed:
+            logger.error(f"Failed subscribers of job {record_id} ({run_dt}): {failed}")
+            failures.append(record_id)
 
+    logger.info(
+        f"Sent {sent} forecasts, {len(failures)} jobs to retry, "
+        f"{deadline.remaining():.1f}s left"
+    )
+    weather.local_forecasts.log_stats()
+    templates.fragments.log_stats()
+    logger.info(f"HTTP latency: {http_client.stats.snapshot()}")
     return {
-        "statusCode": 200,
-        "body": json.dumps(
-            {
-                "subscriber": email,
-                "citiesCount": len(cities),
-                "status": "sent",
-            }
-        ),
+        "batchItemFailures": [
+            {"itemIdentifier": record_id} for record_id in failures if record_id
+        ]
     }
@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+import constants
+from daily_forecast import Forecast
+
+
+def synthetic_response(cities: int, days: int = 16) -> list[dict]:
+    """
+    A multi-city Open-Meteo response for `cities` made-up locations, all
+    starting today like a real run.
+    """
+    today = date.today()
+    dates = [(today + timedelta(days=n)).isoformat() for n in range(days)]
+    codes = list(constants.WEATHER_CODE_MAP)
+    return [
+        {
+            "daily": {
+                "time": dates,
+                "temperature_2m_max": [round(random.uniform(40, 90), 1) for _ in dates],
+                "temperature_2m_min": [round(random.uniform(20, 60), 1) for _ in dates],
+                "weathercode": [random.choice(codes) for _ in dates],
+            }
+        }
+        for _ in range(cities)
+    ]
+
+
+def dict_forecast(daily: dict) -> list[dict]:
+    """
+    The dict-per-day normalization Forecast replaced, kept as the baseline.
+    """
+    dates = daily.get("time", [])
+    highs = daily.get("temperature_2m_max", [])
+    lows = daily.get("temperature_2m_min", [])
+    codes = daily.get("weathercode", [])
+
+    forecast = []
+    for i in range(min(7, len(dates))):
+        if i == 0:
+            label = "Today"
+        elif i == 1:
+            label = "Tomorrow"
+        else:
+            label = datetime.strptime(dates[i], "%Y-%m-%d").strftime("%A")
+        forecast.append(
+            {
+                "date": dates[i],
+                "high": highs[i],
+                "low": lows[i],
+                "code": codes[i],
+                "label": label,
+                "description": constants.WEATHER_CODE_MAP.get(
+                    codes[i], "Unknown Weather Code"
+                ),
+            }
+        )
+    return forecast
+
+
+def render_dicts(forecast: list[dict]) -> list[str]:
+    return [
+        f"  {day['label']} {day['high']}°F / {day['low']}°F ({day['description']})"
+        for day in forecast
+    ]
+
+
+def render_columns(forecast: Forecast) -> list[str]:
+    return [
+        f"  {label} {high}°F / {low}°F ({description})"
+        for label, high, low, description in forecast.days()
+    ]
+
+
+def line_email_body(forecast_payload: list[dict]) -> str:
+    """
+    The line-by-line email body the templates replaced, kept as the baseline.
+    """
+    today_str = datetime.now().strftime("%A, %B %d, %Y")
+    lines = [
+        "Good morning!",
+        f"Today is {today_str}",
+        "",
+        "🌤 Here is your daily detailed forecast:",
+        "",
+    ]
+    for city in forecast_payload:
+        lines.append(f"- {city.get('city')}, {city.get('state')}")
+        lines.extend(render_columns(city["forecast"]))
+        lines.append("")
+    lines.extend(
+        [
+            "------------------------------",
+            "Manage your subscriptions",
+            "------------------------------",
+            "",
+            "Send an email to:",
+            "weather@inbound.geistdevelopment.com",
+            "",
+            "One command per line in the body:",
+            "ADD Charlotte, NC",
+            "REMOVE Raleigh, NC",
+            "LIST",
+            "",
+            "------------------------------",
+            "",
+            "— Wetter Bericht ☀️",
+            "",
+            "This is an automated email. Do not reply.",
+        ]
+    )
+    return "\n".join(lines)
+
+
+def best_of(repeats: int, fn, *args) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def compare(cities: int = 5_000, repeats: int = 5) -> dict:
+    """
+    Times normalizing and rendering one response of `cities` locations with
+    the dict-per-day baseline and with Forecast, and building as many emails
+    line by line and from templates. Also compares the size of the cached
+    forms.
+    """
+    response = synthetic_response(cities)
+    dailies = [result["daily"] for result in response]
+
+    def normalize_dicts():
+        return [dict_forecast(daily) for daily in dailies]
+
+    def normalize_columns():
+        return [Forecast.from_daily(daily) for daily in dailies]
+
+    dicts, columns = normalize_dicts(), normalize_columns()
+    if [render_dicts(f) for f in dicts] != [render_columns(f) for f in columns]:
+        raise AssertionError("Forecast renders differently from the baseline")
+
+    stages = {
+        "normalize": (
+            best_of(repeats, normalize_dicts),
+            best_of(repeats, normalize_columns),
+        ),
+        "render": (
+            best_of(repeats, lambda: [render_dicts(f) for f in dicts]),
+            best_of(repeats, lambda: [render_columns(f) for f in columns]),
+        ),
+    }
+    stages["total"] = tuple(map(sum, zip(*stages.values())))
+    stages["emails"] = compare_emails(columns, repeats)
+    cached = (
+        sum(len(json.dumps(f, separators=(",", ":"))) for f in dicts),
+        sum(len(json.dumps(f.to_json(), separators=(",", ":"))) for f in columns),
+    )
+
+    return {
+        "cities": cities,
+        "stages": {
+            name: {
+                "beforeSeconds": round(baseline, 4),
+                "afterSeconds": round(current, 4),
+                "speedup": round(baseline / current, 1) if current else None,
+            }
+            for name, (baseline, current) in stages.items()
+        },
+        "cachedBytes": {"dict": cached[0], "forecast": cached[1]},
+    }
+
+
+def compare_emails(
+    forecasts: list[Forecast],
+    repeats: int,
+    locations: int = 200,
+    cities_per_subscriber: int = 3,
+) -> tuple[float, float]:
+    """
+    Times building one email per forecast, each subscriber following
+    `cities_per_subscriber` of `locations` shared cities, line by line and
+    from the cached location blocks.
+    """
+    # Imported here so running this file can set their environment first
+    import ses
+    import templates
+
+    pool = [
+        {"city": f"City {n}", "state": "NC", "forecast": forecast}
+        for n, forecast in enumerate(forecasts[:locations])
+    ]
+    payloads = [
+        [pool[(n + k) % len(pool)] for k in range(cities_per_subscriber)]
+        for n in range(len(forecasts))
+    ]
+    if [line_email_body(p) for p in payloads[:10]] != [
+        ses.build_email_body(p) for p in payloads[:10]
+    ]:
+        raise AssertionError("Templates render differently from the baseline")
+
+    templates.fragments.entries.clear()
+    return (
+        best_of(repeats, lambda: [line_email_body(p) for p in payloads]),
+        best_of(repeats, lambda: [ses.build_email_body(p) for p in payloads]),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark forecast normalization and email rendering"
+    )
+    parser.add_argument("cities", type=int, nargs="?", default=5_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    # ses creates its client at import; nothing is sent anywhere
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    print(json.dumps(compare(args.cities, args.repeats), indent=2))
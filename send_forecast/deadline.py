@@ -0,0 +1,52 @@
+import os
+import time
+
+# Kept free at the end of every invocation for sending the emails
+SEND_RESERVE_MS = int(os.environ.get("SEND_RESERVE_MS", "5000"))
+# Budget assumed when there is no Lambda context, e.g. in local runs
+DEFAULT_BUDGET_MS = 30_000
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a stage has no time left to run in.
+    """
+
+
+class Deadline:
+    """
+    The time left in an invocation, measured from the Lambda context. Each
+    stage sizes its timeouts from it and leaves `reserve_ms` for the stages
+    after it, so a slow weather fetch cannot eat the time needed to send.
+    """
+
+    __slots__ = ("ends_at",)
+
+    def __init__(self, remaining_ms: float):
+        self.ends_at = time.monotonic() + remaining_ms / 1000
+
+    @classmethod
+    def from_context(cls, context) -> "Deadline":
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return cls(DEFAULT_BUDGET_MS)
+        return cls(context.get_remaining_time_in_millis())
+
+    def remaining(self, reserve_ms: float = 0) -> float:
+        """
+        Seconds left before the deadline, minus `reserve_ms`.
+        """
+        return max(self.ends_at - time.monotonic() - reserve_ms / 1000, 0.0)
+
+    def cutoff(self, reserve_ms: float = SEND_RESERVE_MS) -> float:
+        """
+        The time.monotonic() value a stage has to end by to leave
+        `reserve_ms`, for calls that bound all their attempts by it.
+        """
+        return self.ends_at - reserve_ms / 1000
+
+    def expired(self, reserve_ms: float = 0) -> bool:
+        return self.remaining(reserve_ms) <= 0
+
+    def check(self, stage: str, reserve_ms: float = 0):
+        if self.expired(reserve_ms):
+            raise DeadlineExceeded(f"No time left for {stage}")
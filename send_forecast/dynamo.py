@@ -1,12 +1,38 @@
+import json
 import logging
 import boto3
 import os
+import time
+import uuid
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 from boto3.dynamodb.types import TypeDeserializer
+from daily_forecast import Forecast
+from deadline import SEND_RESERVE_MS, Deadline
 
 logger = logging.getLogger(__name__)
 
-dynamodb = boto3.client("dynamodb")
+# Bounded so a query left running past its invocation's deadline ends soon
+dynamodb = boto3.client(
+    "dynamodb",
+    config=Config(
+        connect_timeout=SEND_RESERVE_MS / 4000,
+        read_timeout=SEND_RESERVE_MS / 2000,
+        retries={"max_attempts": 3, "mode": "standard"},
+    ),
+)
 TABLE_NAME = os.environ["DYNAMO_TABLE_NAME"]
+LEDGER_TTL_DAYS = int(os.environ.get("LEDGER_TTL_DAYS", "3"))
+# A PENDING claim whose holder died can be taken over after this long
+LEDGER_LEASE_SECONDS = int(os.environ.get("LEDGER_LEASE_SECONDS", "60"))
+ENVELOPE_WORKERS = int(os.environ.get("ENVELOPE_WORKERS", "8"))
+# BatchGetItem and BatchWriteItem request limits
+MAX_BATCH_GET = 100
+MAX_BATCH_WRITE = 25
+
+# Shared by every subscriber of an envelope and across warm invocations
+executor = ThreadPoolExecutor(max_workers=ENVELOPE_WORKERS)
 
 
 def deserialize_item(item):
@@ -25,3 +51,241 @@ def get_cities_for_subscriber(email: str):
     )
     items = response.get("Items", [])
     return [deserialize_item(item) for item in items]
+
+
+def get_cities_for_subscribers(
+    emails: list[str], deadline: Deadline | None = None
+) -> dict[str, list[dict] | Exception]:
+    """
+    Runs the subscription queries of several subscribers concurrently.
+    A failed query is returned as its exception so it only affects that
+    subscriber. Queries still running when only the time reserved for
+    sending is left fail with a TimeoutError, and queries that had not
+    started by then are not run.
+    """
+
+    def query(email):
+        if deadline is not None and deadline.expired(SEND_RESERVE_MS):
+            return TimeoutError("Subscription query ran out of time")
+        try:
+            return get_cities_for_subscriber(email)
+        except Exception as e:
+            logger.exception(f"Failed to load cities for {email}")
+            return e
+
+    futures = [executor.submit(query, email) for email in emails]
+    timeout = deadline.remaining(SEND_RESERVE_MS) if deadline is not None else None
+    _, late = wait(futures, timeout=timeout)
+    if late:
+        logger.warning(f"Cities of {len(late)} subscribers not loaded in time")
+        for future in late:
+            future.cancel()
+
+    return {
+        email: (
+            TimeoutError("Subscription query ran out of time")
+            if future in late
+            else future.result()
+        )
+        for email, future in zip(emails, futures)
+    }
+
+
+def claim_ledgers(run_date: str, emails: list[str]) -> list[str]:
+    """
+    Claims the SEND ledger entry of every subscriber concurrently and returns
+    the ones that were not handled before.
+    """
+    claims = executor.map(lambda email: claim_ledger(run_date, email), emails)
+    return [email for email, claimed in zip(emails, claims) if claimed]
+
+
+def _ledger_key(run_date: str, email: str, stage: str) -> dict:
+    return {"PK": {"S": f"LEDGER#{run_date}#{email}"}, "SK": {"S": stage}}
+
+
+def claim_ledger(run_date: str, email: str, stage: str = "SEND") -> bool:
+    """
+    Marks `stage` of the run PENDING for the subscriber for
+    LEDGER_LEASE_SECONDS. Returns False if it is DONE, or PENDING under a
+    live lease, i.e. this is a duplicate delivery. A PENDING claim whose
+    lease ran out, e.g. because its invocation timed out, is taken over.
+    """
+    now = int(time.time())
+    try:
+        dynamodb.put_item(
+            TableName=TABLE_NAME,
+            Item={
+                **_ledger_key(run_date, email, stage),
+                "status": {"S": "PENDING"},
+                "leaseUntil": {"N": str(now + LEDGER_LEASE_SECONDS)},
+                "createdAt": {"S": datetime.now().isoformat()},
+                "expiresAt": {"N": str(now + LEDGER_TTL_DAYS * 86400)},
+            },
+            ConditionExpression=(
+                "attribute_not_exists(PK) OR (#status = :pending AND leaseUntil < :now)"
+            ),
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":pending": {"S": "PENDING"},
+                ":now": {"N": str(now)},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def complete_ledgers(entries: list[tuple[str, str]], stage: str = "SEND"):
+    """
+    Marks the claims of (runDate, email) pairs DONE once their work
+    succeeded, with BatchWriteItem. Only DONE claims stop a retry for good.
+    """
+    now = datetime.now().isoformat()
+    expires_at = str(int(time.time()) + LEDGER_TTL_DAYS * 86400)
+    writes = [
+        {
+            "PutRequest": {
+                "Item": {
+                    **_ledger_key(run_date, email, stage),
+                    "status": {"S": "DONE"},
+                    "completedAt": {"S": now},
+                    "expiresAt": {"N": expires_at},
+                }
+            }
+        }
+        for run_date, email in entries
+    ]
+
+    for start in range(0, len(writes), MAX_BATCH_WRITE):
+        pending = {TABLE_NAME: writes[start : start + MAX_BATCH_WRITE]}
+        while pending:
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get("UnprocessedItems")
+
+
+def release_ledger(run_date: str, email: str, stage: str = "SEND"):
+    """
+    Removes a claim whose work failed, so a retried delivery can do it again.
+    """
+    dynamodb.delete_item(TableName=TABLE_NAME, Key=_ledger_key(run_date, email, stage))
+
+
+def _forecast_key(cache_key: str, lock: bool = False) -> dict:
+    location, date = cache_key.rsplit("#", 1)
+    sort_key = f"LOCK#{date}" if lock else date
+    return {"PK": {"S": f"FORECAST#{location}"}, "SK": {"S": sort_key}}
+
+
+def get_cached_forecasts(
+    cache_keys: list[str],
+) -> tuple[dict[str, Forecast], dict[str, Forecast]]:
+    """
+    Reads the cached forecasts of the given "<lat>#<lon>#<date>" keys with
+    BatchGetItem. Returns (fresh, stale) forecasts by key: stale ones are
+    past freshUntil but may still be served while one caller refreshes
+    them. Expired entries are left out, since TTL deletion can lag behind
+    expiresAt.
+    """
+    now = int(time.time())
+    fresh, stale = {}, {}
+
+    for start in range(0, len(cache_keys), MAX_BATCH_GET):
+        request = {
+            TABLE_NAME: {
+                "Keys": [
+                    _forecast_key(key) for key in cache_keys[start : start + MAX_BATCH_GET]
+                ],
+                "ProjectionExpression": "PK, SK, forecast, freshUntil, expiresAt",
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(TABLE_NAME, []):
+                if int(item["expiresAt"]["N"]) <= now:
+                    continue
+                location = item["PK"]["S"].removeprefix("FORECAST#")
+                key = f"{location}#{item['SK']['S']}"
+                forecast = Forecast.load(json.loads(item["forecast"]["S"]))
+                fresh_until = int(item.get("freshUntil", item["expiresAt"])["N"])
+                if fresh_until > now:
+                    fresh[key] = forecast
+                else:
+                    stale[key] = forecast
+            request = response.get("UnprocessedKeys")
+
+    return fresh, stale
+
+
+def put_cached_forecasts(
+    forecasts: dict[str, Forecast], fresh_seconds: int, stale_seconds: int = 0
+):
+    """
+    Stores forecasts under their "<lat>#<lon>#<date>" keys with
+    BatchWriteItem. They are fresh for `fresh_seconds` and may be served
+    stale for `stale_seconds` after that.
+    """
+    now = int(time.time())
+    fresh_until = str(now + fresh_seconds)
+    expires_at = str(now + fresh_seconds + stale_seconds)
+    writes = [
+        {
+            "PutRequest": {
+                "Item": {
+                    **_forecast_key(key),
+                    "forecast": {"S": json.dumps(forecast.to_json(), separators=(",", ":"))},
+                    "freshUntil": {"N": fresh_until},
+                    "expiresAt": {"N": expires_at},
+                }
+            }
+        }
+        for key, forecast in forecasts.items()
+    ]
+
+    for start in range(0, len(writes), MAX_BATCH_WRITE):
+        pending = {TABLE_NAME: writes[start : start + MAX_BATCH_WRITE]}
+        while pending:
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get("UnprocessedItems")
+
+
+def acquire_forecast_lock(cache_key: str, lease_seconds: int) -> str | None:
+    """
+    Claims the right to fetch one location's forecast with a conditional
+    put. A lock whose lease ran out, e.g. because its holder crashed, can be
+    taken over. Returns the owner token to release it with, or None if
+    another caller holds it.
+    """
+    now = int(time.time())
+    owner = uuid.uuid4().hex
+    try:
+        dynamodb.put_item(
+            TableName=TABLE_NAME,
+            Item={
+                **_forecast_key(cache_key, lock=True),
+                "owner": {"S": owner},
+                "expiresAt": {"N": str(now + lease_seconds)},
+            },
+            ConditionExpression="attribute_not_exists(PK) OR expiresAt < :now",
+            ExpressionAttributeValues={":now": {"N": str(now)}},
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return None
+    return owner
+
+
+def release_forecast_lock(cache_key: str, owner: str):
+    """
+    Deletes the lock only if `owner` still holds it. A holder that ran past
+    its lease leaves alone the lock another caller has taken over since.
+    """
+    try:
+        dynamodb.delete_item(
+            TableName=TABLE_NAME,
+            Key=_forecast_key(cache_key, lock=True),
+            ConditionExpression="#owner = :me",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={":me": {"S": owner}},
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        logger.info(f"Forecast lock of {cache_key} was taken over, not releasing it")
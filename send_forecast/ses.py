@@ -1,73 +1,85 @@
 import logging
 import boto3
 import constants
+import templates
+from botocore.config import Config
+from daily_forecast import EMPTY_FORECAST, Forecast
 from datetime import datetime
+from deadline import SEND_RESERVE_MS, Deadline
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ses = boto3.client("ses")
+# A send has to fit in the time reserved for it at the end of an invocation
+ses = boto3.client(
+    "ses",
+    config=Config(
+        connect_timeout=SEND_RESERVE_MS / 4000,
+        read_timeout=SEND_RESERVE_MS / 2000,
+        retries={"max_attempts": 2, "mode": "standard"},
+    ),
+)
+
+
+HEADER = templates.Template(
+    "Good morning!\n"
+    "Today is {today}\n"
+    "\n"
+    "🌤 Here is your daily detailed forecast:\n"
+    "\n"
+)
+NO_LOCATIONS = templates.Template("- (No locations configured)\n\n")
+FOOTER = templates.Template(
+    "------------------------------\n"
+    "Manage your subscriptions\n"
+    "------------------------------\n"
+    "\n"
+    "Send an email to:\n"
+    "weather@inbound.geistdevelopment.com\n"
+    "\n"
+    "One command per line in the body:\n"
+    "ADD Charlotte, NC\n"
+    "REMOVE Raleigh, NC\n"
+    "LIST\n"
+    "\n"
+    "------------------------------\n"
+    "\n"
+    "— Wetter Bericht ☀️\n"
+    "\n"
+    "This is an automated email. Do not reply."
+)
 
 
 def build_email_body(forecast_payload: list[dict]) -> str:
+    """
+    Joins the header, the cached block of every location and the footer.
+    A location shared with earlier subscribers costs a dictionary lookup.
+    """
     today_str = datetime.now().strftime("%A, %B %d, %Y")
-    lines = [
-        "Good morning!",
-        f"Today is {today_str}",
-        "",
-        "🌤 Here is your daily detailed forecast:",
-        "",
-    ]
+    parts = [HEADER.render(today=today_str)]
 
     if not forecast_payload:
-        lines.append("- (No locations configured)")
-        lines.append("")
-    else:
-        for city in forecast_payload:
-            lines.append(f"- {city.get('city')}, {city.get('state')}")
-            try:
-                forecast = city.get("forecast", [])
-                for day in forecast:
-                    lines.append(
-                        f"  {day['label']} {day['high']}°F / {day['low']}°F ({day['description']})"
-                    )
-            except Exception as e:
-                logger.exception(
-                    f"Failed to fetch weather for {city.get('city')}, {city.get('state')}",
-                    f"Err: {e}",
-                )
-                lines.append("  (Weather unavailable)")
-
-            lines.append("")
-
-    # FOOTER
-    footer = [
-        "------------------------------",
-        "Manage your subscriptions",
-        "------------------------------",
-        "",
-        "Send an email to:",
-        "weather@inbound.geistdevelopment.com",
-        "",
-        "One command per line in the body:",
-        "ADD Charlotte, NC",
-        "REMOVE Raleigh, NC",
-        "LIST",
-        "",
-        "------------------------------",
-        "",
-        "— Wetter Bericht ☀️",
-        "",
-        "This is an automated email. Do not reply.",
-    ]
-    lines.extend(footer)
+        parts.append(NO_LOCATIONS.render())
+    for city in forecast_payload:
+        name, state = city.get("city"), city.get("state")
+        try:
+            forecast = Forecast.load(city.get("forecast"))
+            parts.append(templates.location_fragment(name, state, forecast))
+        except Exception:
+            logger.exception(f"Failed to render weather for {name}, {state}")
+            # Weather that cannot be shown is left out of the email
+            parts.append(templates.render_location(name, state, EMPTY_FORECAST))
 
-    return "\n".join(lines)
+    parts.append(FOOTER.render())
+    return "".join(parts)
 
 
-def send_email_to_subscriber(email: str, body: str):
+def send_email_to_subscriber(email: str, body: str, deadline: Deadline | None = None):
     sender = constants.SENDER_EMAIL
+    # Past the deadline the job is redelivered instead of cut off mid-send
+    if deadline is not None:
+        deadline.check(f"sending to {email}")
     logger.info(f"Sending forecast email to {email}")
 
     ses.send_email(
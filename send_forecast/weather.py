@@ -1,48 +1,59 @@
 import logging
-import requests
-from datetime import datetime
-import constants
+import os
+import time
+import circuit_breaker
+import http_client
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import dynamo
+from daily_forecast import EMPTY_FORECAST, Forecast
+from deadline import SEND_RESERVE_MS, Deadline
+import local_cache
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Decimal places coordinates are rounded to for the cache; 2 is about 1 km
+FORECAST_CACHE_PRECISION = int(os.environ.get("FORECAST_CACHE_PRECISION", "2"))
+# Open-Meteo refreshes its models about hourly to every few hours; 0 disables
+FORECAST_CACHE_TTL_HOURS = float(os.environ.get("FORECAST_CACHE_TTL_HOURS", "3"))
+# How long past its TTL a forecast may still be served while it is refreshed
+FORECAST_CACHE_STALE_HOURS = float(os.environ.get("FORECAST_CACHE_STALE_HOURS", "6"))
+# Lease of the per-location fetch lock, and how long the others wait on it
+FORECAST_LOCK_SECONDS = int(os.environ.get("FORECAST_LOCK_SECONDS", "15"))
+FORECAST_LOCK_WAIT_SECONDS = float(os.environ.get("FORECAST_LOCK_WAIT_SECONDS", "5"))
+FORECAST_LOCK_POLL_SECONDS = 0.25
+# Cities per multi-city request, and a cap on the length of its coordinates
+WEATHER_CHUNK_CITIES = int(os.environ.get("WEATHER_CHUNK_CITIES", "50"))
+WEATHER_MAX_URL_CHARS = int(os.environ.get("WEATHER_MAX_URL_CHARS", "3000"))
+WEATHER_FETCH_WORKERS = int(os.environ.get("WEATHER_FETCH_WORKERS", "4"))
 
-def format_day_label(date_str: str, index: int) -> str:
-    if index == 0:
-        return "Today"
-    if index == 1:
-        return "Tomorrow"
+# Fetches the chunks of a payload concurrently, kept across warm invocations
+fetch_executor = ThreadPoolExecutor(max_workers=WEATHER_FETCH_WORKERS)
+# Kept shorter than the shared TTL, since a local copy may be read late in it
+LOCAL_FORECAST_CACHE_MINUTES = float(
+    os.environ.get("LOCAL_FORECAST_CACHE_MINUTES", "30")
+)
 
-    dt = datetime.strptime(date_str, "%Y-%m-%d")
-    return dt.strftime("%A")
+# Lives as long as the container, across warm invocations
+local_forecasts = local_cache.LocalCache(
+    "forecasts", LOCAL_FORECAST_CACHE_MINUTES * 60
+)
 
 
-def normalize_daily_forecast(daily: dict) -> list[dict]:
-    dates = daily.get("time", [])
-    highs = daily.get("temperature_2m_max", [])
-    lows = daily.get("temperature_2m_min", [])
-    codes = daily.get("weathercode", [])
-
-    forecast = []
-    for i in range(min(7, len(dates))):
-        forecast.append(
-            {
-                "date": dates[i],
-                "high": highs[i],
-                "low": lows[i],
-                "code": codes[i],
-                "label": format_day_label(dates[i], i),
-                "description": constants.WEATHER_CODE_MAP.get(
-                    codes[i], "Unknown Weather Code"
-                ),
-            }
-        )
-
-    return forecast
+def http_deadline(deadline: Deadline | None) -> float | None:
+    """
+    When a weather request has to end, retries included: before the time
+    reserved for sending.
+    """
+    if deadline is None:
+        return None
+    return deadline.cutoff(SEND_RESERVE_MS)
 
 
-def fetch_weather(lat: float, lon: float):
+def fetch_weather(lat: float, lon: float, until: float | None = None) -> Forecast:
     url = "https://api.open-meteo.com/v1/forecast"
     params = {
         "latitude": lat,
@@ -54,35 +65,11 @@ def fetch_weather(lat: float, lon: float):
         "timezone": "auto",
     }
 
-    response = requests.get(url, params=params, timeout=10)
-    response.raise_for_status()
-    data = response.json()
-
-    daily = data.get("daily", {})
-    dates = daily.get("time", [])
-    highs = daily.get("temperature_2m_max", [])
-    lows = daily.get("temperature_2m_min", [])
-    codes = daily.get("weathercode", [])
-
-    forecast = []
-    for i in range(min(7, len(dates))):
-        forecast.append(
-            {
-                "date": dates[i],
-                "high": highs[i],
-                "low": lows[i],
-                "code": codes[i],
-                "label": format_day_label(dates[i], i),
-                "description": constants.WEATHER_CODE_MAP.get(
-                    codes[i], "Unknown Weather Code"
-                ),
-            }
-        )
+    response = http_client.get(url, params=params, until=until)
+    return Forecast.from_daily(response.json().get("daily", {}))
 
-    return forecast
 
-
-def fetch_multi_city_weather(cities):
+def fetch_multi_city_weather(cities, until: float | None = None):
     lats = ",".join(str(city.get("lat")) for city in cities)
     lons = ",".join(str(city.get("lon")) for city in cities)
 
@@ -97,8 +84,7 @@ def fetch_multi_city_weather(cities):
         "timezone": "auto",
     }
 
-    response = requests.get(url, params=params, timeout=10)
-    response.raise_for_status()
+    response = http_client.get(url, params=params, until=until)
     data = response.json()
 
     if not isinstance(data, list):
@@ -107,9 +93,284 @@ def fetch_multi_city_weather(cities):
     return data
 
 
-def build_forecast_payload(cities: list[dict]):
+def forecast_cache_key(city: dict) -> str:
+    """
+    "<lat>#<lon>#<date>" with the coordinates rounded to
+    FORECAST_CACHE_PRECISION and the date local to the city when its
+    timezone is known, so "Today" in a cached forecast is the city's today.
+    """
+    try:
+        tz = ZoneInfo(city["timezone"]) if city.get("timezone") else timezone.utc
+    except Exception as e:
+        logger.warning(f"Unknown timezone {city['timezone']!r}, keying the forecast by UTC: {e}")
+        tz = timezone.utc
+    date = datetime.now(tz).strftime("%Y-%m-%d")
+    lat = round(float(city["lat"]), FORECAST_CACHE_PRECISION)
+    lon = round(float(city["lon"]), FORECAST_CACHE_PRECISION)
+    return f"{lat}#{lon}#{date}"
+
+
+def fetch_and_cache(
+    cities_by_key: dict[str, dict], deadline: Deadline | None = None
+) -> dict[str, Forecast]:
+    """
+    Fetches the forecasts of the given cities in one batch and stores the
+    successful ones in the cache. Returns every forecast by cache key, empty
+    for failed fetches.
+    """
+    if not cities_by_key:
+        return {}
+
+    fetched = {
+        key: entry["forecast"]
+        for key, entry in zip(
+            cities_by_key,
+            fetch_forecast_payload(list(cities_by_key.values()), deadline),
+        )
+    }
+    # Failed fetches come back empty and are not cached
+    fresh = {key: forecast for key, forecast in fetched.items() if forecast}
+    try:
+        dynamo.put_cached_forecasts(
+            fresh,
+            int(FORECAST_CACHE_TTL_HOURS * 3600),
+            int(FORECAST_CACHE_STALE_HOURS * 3600),
+        )
+    except Exception:
+        logger.exception("Failed to write the forecast cache")
+    return fetched
+
+
+def claim_fetches(keys: list[str]) -> dict[str, str | None]:
+    """
+    Takes the single-flight lock of every key concurrently and returns the
+    keys this invocation should fetch, with the owner token of their lock.
+    A lock that cannot be taken because of an error counts as owned with no
+    token, so a DynamoDB error never stops a send.
+    """
+
+    def claim(key):
+        try:
+            return dynamo.acquire_forecast_lock(key, FORECAST_LOCK_SECONDS) or False
+        except Exception:
+            logger.exception(f"Failed to take the forecast lock of {key}")
+            return None
+
+    return {
+        key: owner
+        for key, owner in zip(keys, dynamo.executor.map(claim, keys))
+        if owner is not False
+    }
+
+
+def wait_for_forecasts(
+    keys: list[str], deadline: Deadline | None = None
+) -> dict[str, Forecast]:
+    """
+    Polls the cache for forecasts another invocation is fetching, for at
+    most FORECAST_LOCK_WAIT_SECONDS and never into the time reserved for
+    sending. Returns the ones that showed up.
+    """
+    found = {}
+    wait_seconds = FORECAST_LOCK_WAIT_SECONDS
+    if deadline is not None:
+        wait_seconds = min(wait_seconds, deadline.remaining(SEND_RESERVE_MS))
+    ends_at = time.monotonic() + wait_seconds
+    while len(found) < len(keys) and time.monotonic() < ends_at:
+        time.sleep(FORECAST_LOCK_POLL_SECONDS)
+        pending = [key for key in keys if key not in found]
+        try:
+            fresh, _ = dynamo.get_cached_forecasts(pending)
+        except Exception:
+            logger.exception("Failed to read the forecast cache")
+            break
+        found.update(fresh)
+    return found
+
+
+def load_shared_forecasts(
+    cities_by_key: dict[str, dict], deadline: Deadline | None = None
+) -> tuple[dict[str, Forecast], set[str]]:
+    """
+    Loads forecasts from the shared DynamoDB cache and fetches the misses.
+    Each miss is fetched by the one invocation holding its lock. The
+    others wait briefly for the result and fall back to fetching it
+    themselves. A stale entry is served right away while the lock holder
+    refreshes it. Returns the forecasts and the keys that were served stale.
+    """
+    try:
+        forecasts, stale = dynamo.get_cached_forecasts(list(cities_by_key))
+    except Exception:
+        logger.exception("Failed to read the forecast cache")
+        forecasts, stale = {}, {}
+
+    misses = [key for key in cities_by_key if key not in forecasts and key not in stale]
+    if misses or stale:
+        logger.info(
+            f"Forecast cache: {len(forecasts)} fresh, {len(stale)} stale, "
+            f"{len(misses)} misses"
+        )
+
+    owned = claim_fetches(misses + list(stale))
+    try:
+        fetched = fetch_and_cache(
+            {key: cities_by_key[key] for key in owned}, deadline
+        )
+    finally:
+        for key, owner in owned.items():
+            if owner is None:
+                continue
+            try:
+                dynamo.release_forecast_lock(key, owner)
+            except Exception:
+                logger.exception(f"Failed to release the forecast lock of {key}")
+
+    # Stale entries not refreshed here are served as they are
+    forecasts.update(stale)
+    refreshed = {key: forecast for key, forecast in fetched.items() if forecast}
+    forecasts.update(refreshed)
+
+    waiting = [key for key in misses if key not in owned]
+    if waiting:
+        forecasts.update(wait_for_forecasts(waiting, deadline))
+        late = {key: cities_by_key[key] for key in waiting if key not in forecasts}
+        if late and deadline is not None and deadline.expired(SEND_RESERVE_MS):
+            logger.warning(f"No time left to fetch {len(late)} forecasts, sending without")
+        elif late:
+            logger.info(f"Gave up waiting for {len(late)} forecasts, fetching them")
+            forecasts.update(fetch_and_cache(late, deadline))
+
+    return forecasts, set(stale) - set(refreshed)
+
+
+def build_forecast_payload(cities: list[dict], deadline: Deadline | None = None):
+    """
+    Builds the forecast payload like fetch_forecast_payload, reading the
+    container's local cache first, then the shared forecast cache, and
+    fetching only what neither has, in one batch. The caches are skipped
+    if they fail.
+    """
+    if not cities or FORECAST_CACHE_TTL_HOURS <= 0:
+        return fetch_forecast_payload(cities, deadline)
+
+    keys = [forecast_cache_key(city) for city in cities]
+    cities_by_key = {}
+    for key, city in zip(keys, cities):
+        cities_by_key.setdefault(key, city)
+
+    forecasts = {}
+    for key in cities_by_key:
+        cached = local_forecasts.get(key)
+        if cached is not None:
+            forecasts[key] = Forecast.load(cached)
+
+    remote = {key: city for key, city in cities_by_key.items() if key not in forecasts}
+    if remote:
+        loaded, stale = load_shared_forecasts(remote, deadline)
+        for key, forecast in loaded.items():
+            # Stale and failed forecasts are not kept on the container
+            if forecast and key not in stale:
+                local_forecasts.set(key, forecast.to_json())
+        forecasts.update(loaded)
+
+    return [
+        {
+            "city": city.get("city"),
+            "state": city.get("state"),
+            "forecast": forecasts.get(key, EMPTY_FORECAST),
+        }
+        for key, city in zip(keys, cities)
+    ]
+
+
+def chunk_cities(cities: list[dict]):
+    """
+    Splits cities into multi-city requests of at most WEATHER_CHUNK_CITIES
+    cities whose coordinate lists stay under WEATHER_MAX_URL_CHARS.
+    """
+    chunk, chars = [], 0
+    for city in cities:
+        city_chars = len(str(city.get("lat"))) + len(str(city.get("lon"))) + 2
+        if chunk and (
+            len(chunk) >= WEATHER_CHUNK_CITIES or chars + city_chars > WEATHER_MAX_URL_CHARS
+        ):
+            yield chunk
+            chunk, chars = [], 0
+        chunk.append(city)
+        chars += city_chars
+    if chunk:
+        yield chunk
+
+
+def fetch_chunk(
+    cities: list[dict], deadline: Deadline | None = None
+) -> list[Forecast]:
     """
-        Build a forecast payload for a list of cities.
+    Fetches the forecasts of one chunk with a single request. Raises if the
+    request fails; a city whose result cannot be normalized gets an empty
+    forecast.
+    """
+    until = http_deadline(deadline)
+    # A single coordinate gets an object back, not a list
+    if len(cities) == 1:
+        return [fetch_weather(cities[0]["lat"], cities[0]["lon"], until)]
+
+    forecasts = []
+    for city, result in zip(cities, fetch_multi_city_weather(cities, until)):
+        try:
+            forecasts.append(Forecast.from_daily(result.get("daily", {})))
+        except Exception as e:
+            logger.exception(
+                f"Failed to normalize weather for {city.get('city')}, "
+                f"{city.get('state')}: {e}"
+            )
+            forecasts.append(EMPTY_FORECAST)
+    return forecasts
+
+
+def fetch_isolated(
+    cities: list[dict], deadline: Deadline | None = None
+) -> list[Forecast]:
+    """
+    Fetches a chunk, and if that fails, bisects it and fetches both halves
+    concurrently until the failing cities are isolated. A bad coordinate
+    costs about 2 * log2(n) extra requests, not n. Nothing is fetched or
+    bisected once only the time reserved for sending is left, so a chunk
+    that starts late, e.g. queued past its invocation, returns at once.
+    """
+    if deadline is not None and deadline.expired(SEND_RESERVE_MS):
+        return [EMPTY_FORECAST for _ in cities]
+    try:
+        return fetch_chunk(cities, deadline)
+    except circuit_breaker.CircuitOpenError as e:
+        # Bisecting cannot help while the endpoint itself is down
+        logger.warning(f"Skipping weather for {len(cities)} cities: {e}")
+        return [EMPTY_FORECAST for _ in cities]
+    except Exception as e:
+        if len(cities) == 1:
+            city = cities[0]
+            logger.exception(
+                f"Failed to fetch weather for {city.get('city')}, {city.get('state')}"
+            )
+            return [EMPTY_FORECAST]
+        if deadline is not None and deadline.expired(SEND_RESERVE_MS):
+            logger.warning(f"Weather fetch failed for {len(cities)} cities, no time left: {e}")
+            return [EMPTY_FORECAST for _ in cities]
+        logger.warning(f"Weather fetch failed for {len(cities)} cities, bisecting: {e}")
+
+    middle = len(cities) // 2
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        left, right = pool.map(
+            fetch_isolated, [cities[:middle], cities[middle:]], [deadline] * 2
+        )
+    return left + right
+
+
+def fetch_forecast_payload(cities: list[dict], deadline: Deadline | None = None):
+    """
+        Build a forecast payload for a list of cities. Chunks still running
+        when only the time reserved for sending is left get empty forecasts,
+        so the email goes out with what arrived.
 
         :param cities: Subscriber cities
         :type cities: list[dict]
@@ -122,21 +383,18 @@ def build_forecast_payload(cities: list[dict]):
             "city": "Charlotte",
             "state": "NC",
             "country": "US",
-            "forecast": [
-                {
-                    "date": "2025-12-29",
-                    "high": 61.9,
-                    "low": 53.4,
-                    "code": 3,
-                },
-                ...
-            ],
+            "forecast": Forecast(
+                dates=["2025-12-29", ...],
+                highs=[61.9, ...],
+                lows=[53.4, ...],
+                codes=[3, ...],
+            ),
         },
         {
             "city": "Huntersville",
             "state": "NC",
             "country": "US",
-            "forecast": [...],
+            "forecast": Forecast(...),
         },
     ]
     """
@@ -144,54 +402,71 @@ def build_forecast_payload(cities: list[dict]):
     if not cities:
         return []
 
-    payload = []
-    try:
-        weather_data = fetch_multi_city_weather(cities)
-    except Exception as e:
-        logger.exception(f"Failed to fetch multi-city weather: {e}")
+    # Chunks are fetched concurrently; each one isolates its own failures
+    chunks = list(chunk_cities(cities))
+    futures = [fetch_executor.submit(fetch_isolated, chunk, deadline) for chunk in chunks]
+    timeout = deadline.remaining(SEND_RESERVE_MS) if deadline is not None else None
+    _, late = wait(futures, timeout=timeout)
+
+    forecasts = []
+    missing = 0
+    for chunk, future in zip(chunks, futures):
+        if future in late:
+            # Queued chunks are dropped; running ones end at the same cutoff
+            future.cancel()
+            forecasts.extend(EMPTY_FORECAST for _ in chunk)
+            missing += len(chunk)
+        else:
+            forecasts.extend(future.result())
+    if missing:
+        logger.warning(f"Weather for {missing} cities not fetched in time, sending without")
+
+    return [
+        {
+            "city": city.get("city"),
+            "state": city.get("state"),
+            "forecast": forecast,
+        }
+        for city, forecast in zip(cities, forecasts)
+    ]
+
+
+def build_forecast_payloads(
+    cities_by_subscriber: dict[str, list[dict]],
+    deadline: Deadline | None = None,
+) -> dict[str, list[dict]]:
+    """
+    Builds the forecast payload of several subscribers with one weather
+    fetch. Cities shared by subscribers are fetched once, and cities whose
+    forecast came with the job are not fetched at all.
+    """
+    unique_cities = {}
+    for cities in cities_by_subscriber.values():
         for city in cities:
-            try:
-                forecast = fetch_weather(city["lat"], city["lon"])
-                payload.append(
-                    {
-                        "city": city.get("city"),
-                        "state": city.get("state"),
-                        "forecast": forecast,
-                    }
-                )
-            except Exception as e:
-                payload.append(
-                    {
-                        "city": city.get("city"),
-                        "state": city.get("state"),
-                        "forecast": [],
-                    }
-                )
-        return payload
-
-    for idx, result in enumerate(weather_data):
-        city = cities[idx]
-        try:
-            daily = result.get("daily", {})
-            normalized_forecast = normalize_daily_forecast(daily)
-            payload.append(
-                {
-                    "city": city.get("city"),
-                    "state": city.get("state"),
-                    "forecast": normalized_forecast,
-                }
-            )
-        except Exception as e:
-            logger.exception(
-                f"Failed to normalize weather for {city.get('city')}, {city.get('state')}",
-                f"Err: {e}",
-            )
-            payload.append(
-                {
-                    "city": city.get("city"),
-                    "state": city.get("state"),
-                    "forecast": [],
-                }
-            )
+            if "forecast" not in city:
+                unique_cities.setdefault((city["lat"], city["lon"]), city)
+
+    payload = (
+        build_forecast_payload(list(unique_cities.values()), deadline)
+        if unique_cities
+        else []
+    )
+    forecasts = {
+        coords: entry["forecast"] for coords, entry in zip(unique_cities, payload)
+    }
 
-    return payload
+    return {
+        email: [
+            {
+                "city": city.get("city"),
+                "state": city.get("state"),
+                "forecast": (
+                    Forecast.load(city["forecast"])
+                    if "forecast" in city
+                    else forecasts.get((city["lat"], city["lon"]), EMPTY_FORECAST)
+                ),
+            }
+            for city in cities
+        ]
+        for email, cities in cities_by_subscriber.items()
+    }
@@ -0,0 +1,174 @@
+import logging
+import dynamo
+import s3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def subscriber(subscribers: dict[str, dict], email: str) -> dict:
+    return subscribers.setdefault(
+        email,
+        {
+            "email": email,
+            "active": False,
+            "priority": False,
+            "timezone": None,
+            "cities": {},
+        },
+    )
+
+
+def apply_item(subscribers: dict[str, dict], key: dict, item: dict | None) -> bool:
+    """
+    Applies the new state of one profile or subscription item to the
+    snapshot; item is None when it was deleted. Returns False for items the
+    snapshot does not track.
+    """
+    pk, sk = key["PK"], key["SK"]
+
+    if pk.startswith("PROFILE") and sk.startswith("PROFILE#"):
+        email = sk.removeprefix("PROFILE#")
+        if item is None and pk == "PROFILE":
+            # A legacy profile moved into its shard; the new item carries it
+            return True
+        if item is None:
+            subscribers.pop(email, None)
+            return True
+        record = subscriber(subscribers, email)
+        record["active"] = bool(item.get("isActive", False))
+        record["timezone"] = item.get("timezone")
+        record["priority"] = bool(item.get("priority", False))
+        return True
+
+    if pk.startswith("SUBSCRIPTION#"):
+        email = pk.removeprefix("SUBSCRIPTION#")
+        if item is None:
+            if email in subscribers:
+                subscribers[email]["cities"].pop(sk, None)
+            return True
+        subscriber(subscribers, email)["cities"][sk] = {
+            "city": item.get("city"),
+            "state": item.get("state"),
+            "lat": float(item["lat"]),
+            "lon": float(item["lon"]),
+            "timezone": item.get("timezone"),
+        }
+        return True
+
+    return False
+
+
+def is_tracked(key: dict) -> bool:
+    """
+    Whether an item is a profile or subscription, the items apply_item
+    folds into the snapshot.
+    """
+    pk, sk = key["PK"], key["SK"]
+    return (pk.startswith("PROFILE") and sk.startswith("PROFILE#")) or pk.startswith(
+        "SUBSCRIPTION#"
+    )
+
+
+def apply_stream_records(records: list[dict]) -> dict:
+    """
+    Stores the tracked changes of one stream batch as a delta object, in
+    the stream's typed form. The snapshot itself is only rewritten by
+    compaction, so a batch costs its own size, not the subscriber count.
+    """
+    changes = []
+    for record in records:
+        change = record["dynamodb"]
+        if not is_tracked(dynamo.deserialize_item(change["Keys"])):
+            continue
+        image = change.get("NewImage")
+        changes.append(
+            {
+                "keys": change["Keys"],
+                "image": None if record["eventName"] == "REMOVE" else image,
+            }
+        )
+
+    if not changes:
+        return {"applied": 0}
+
+    key = s3.delta_key(
+        records[0]["dynamodb"]["SequenceNumber"],
+        records[-1]["dynamodb"]["SequenceNumber"],
+    )
+    s3.save_delta(key, changes)
+    return {"delta": key, "applied": len(changes)}
+
+
+def compact_snapshot() -> dict:
+    """
+    Folds every pending delta into the snapshot, oldest first, and deletes
+    them. Deltas named in the snapshot header are already folded in; they
+    are only left because deleting them failed, and are deleted again
+    rather than applied on top of newer state.
+    """
+    header, subscribers, etag = s3.load_snapshot()
+    version = header.get("version", 0)
+    folded = set(header.get("compactedDeltas", ()))
+
+    keys = s3.list_deltas()
+    leftover = [key for key in keys if key in folded]
+    pending = [key for key in keys if key not in folded]
+    if not pending:
+        if leftover:
+            s3.delete_deltas(leftover)
+        return {"version": version, "deltas": 0}
+
+    applied = 0
+    for key in pending:
+        for change in s3.load_delta(key):
+            image = change["image"]
+            item = dynamo.deserialize_item(image) if image else None
+            if apply_item(subscribers, dynamo.deserialize_item(change["keys"]), item):
+                applied += 1
+
+    # A conflict fails this run; the next one folds the same deltas
+    s3.save_snapshot(version + 1, subscribers, etag, pending + leftover)
+    failed = s3.delete_deltas(pending + leftover)
+    if failed:
+        logger.error(f"Failed to delete {len(failed)} compacted deltas: {failed}")
+
+    return {"version": version + 1, "deltas": len(pending), "applied": applied}
+
+
+def rebuild_snapshot() -> dict:
+    """
+    Writes the snapshot from a scan of the table. Deltas written before the
+    scan are older than what it reads, so they are marked folded and
+    deleted.
+    """
+    header, _, etag = s3.load_snapshot()
+    version = header.get("version", 0)
+    stale = s3.list_deltas()
+
+    subscribers = {}
+    for item in dynamo.iter_subscriber_items():
+        apply_item(subscribers, {"PK": item["PK"], "SK": item["SK"]}, item)
+
+    s3.save_snapshot(version + 1, subscribers, etag, stale)
+    s3.delete_deltas(stale)
+    return {"version": version + 1, "subscribers": len(subscribers)}
+
+
+def lambda_handler(event, context):
+    event = event or {}
+
+    # Seeds the snapshot from the table, e.g. after the first deploy
+    if event.get("rebuild"):
+        logger.info("Rebuilding subscriber snapshot from DynamoDB")
+        result = rebuild_snapshot()
+    # Scheduled; the only writer of the snapshot besides a rebuild
+    elif event.get("compact"):
+        result = compact_snapshot()
+    else:
+        records = event.get("Records", [])
+        logger.info(f"SubscriberSnapshotFunction invoked with {len(records)} records")
+        result = apply_stream_records(records)
+
+    logger.info(f"Snapshot result: {result}")
+    return result
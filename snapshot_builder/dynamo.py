@@ -0,0 +1,39 @@
+import logging
+import os
+from boto3.dynamodb.types import TypeDeserializer
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+dynamodb = boto3.client("dynamodb")
+DYNAMO_TABLE = os.environ["DYNAMO_TABLE_NAME"]
+
+
+def deserialize_item(item):
+    deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+
+def iter_subscriber_items():
+    """
+    Scans the table for every profile and subscription item, used to build
+    the snapshot from scratch.
+    """
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "FilterExpression": "begins_with(PK, :profile) OR begins_with(PK, :sub)",
+        "ExpressionAttributeValues": {
+            ":profile": {"S": "PROFILE"},
+            ":sub": {"S": "SUBSCRIPTION#"},
+        },
+    }
+
+    while True:
+        response = dynamodb.scan(**params)
+        for item in response.get("Items", []):
+            yield deserialize_item(item)
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+from datetime import datetime
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client("s3")
+SNAPSHOT_BUCKET = os.environ["SNAPSHOT_BUCKET"]
+SNAPSHOT_KEY = os.environ.get("SNAPSHOT_KEY", "subscribers.ndjson")
+# Changes of one stream batch each, folded into the snapshot by compaction
+DELTA_PREFIX = "deltas/"
+# Stream sequence numbers are at most 40 digits; padding keeps keys in order
+SEQUENCE_DIGITS = 40
+# DeleteObjects request limit
+MAX_DELETE_KEYS = 1000
+
+
+class SnapshotConflict(Exception):
+    """
+    The snapshot was replaced between our read and our write.
+    """
+
+
+def load_snapshot() -> tuple[dict, dict[str, dict], str | None]:
+    """
+    Returns (header, subscribers by email, ETag) of the current snapshot,
+    or an empty snapshot with no ETag if none has been written yet.
+    """
+    try:
+        response = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_KEY)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {"version": 0}, {}, None
+        raise
+
+    lines = response["Body"].iter_lines()
+    header = json.loads(next(lines, b"{}") or b"{}")
+    subscribers = {}
+    for line in lines:
+        if line:
+            record = json.loads(line)
+            subscribers[record["email"]] = record
+
+    return header, subscribers, response["ETag"]
+
+
+def save_snapshot(
+    version: int,
+    subscribers: dict[str, dict],
+    etag: str | None,
+    compacted: list[str] = (),
+):
+    """
+    Writes the snapshot as newline-delimited JSON: a header line with the
+    version and the delta keys folded into it, then one line per
+    subscriber. The write only succeeds if the object is still the one we
+    read, so concurrent updates cannot overwrite each other.
+    """
+    header = {
+        "version": version,
+        "updatedAt": datetime.now().isoformat(),
+        "compactedDeltas": list(compacted),
+    }
+    lines = [json.dumps(header, separators=(",", ":"))]
+    lines.extend(
+        json.dumps(subscriber, separators=(",", ":"))
+        for subscriber in subscribers.values()
+    )
+
+    params = {
+        "Bucket": SNAPSHOT_BUCKET,
+        "Key": SNAPSHOT_KEY,
+        "Body": ("\n".join(lines) + "\n").encode("utf-8"),
+        "ContentType": "application/x-ndjson",
+    }
+    if etag:
+        params["IfMatch"] = etag
+    else:
+        params["IfNoneMatch"] = "*"
+
+    try:
+        s3.put_object(**params)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in (
+            "PreconditionFailed",
+            "ConditionalRequestConflict",
+        ):
+            raise SnapshotConflict(f"Snapshot changed while applying version {version}")
+        raise
+
+    logger.info(f"Wrote snapshot version {version} with {len(subscribers)} subscribers")
+
+
+def delta_key(first_sequence: str, last_sequence: str) -> str:
+    return (
+        f"{DELTA_PREFIX}{first_sequence.zfill(SEQUENCE_DIGITS)}"
+        f"-{last_sequence.zfill(SEQUENCE_DIGITS)}.ndjson"
+    )
+
+
+def save_delta(key: str, changes: list[dict]):
+    """
+    Writes the changes of one stream batch, one {"key", "item"} per line.
+    A redelivered batch finds its delta already written and leaves it.
+    """
+    body = "\n".join(json.dumps(change, separators=(",", ":")) for change in changes)
+    try:
+        s3.put_object(
+            Bucket=SNAPSHOT_BUCKET,
+            Key=key,
+            Body=(body + "\n").encode("utf-8"),
+            ContentType="application/x-ndjson",
+            IfNoneMatch="*",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in (
+            "PreconditionFailed",
+            "ConditionalRequestConflict",
+        ):
+            logger.info(f"Delta {key} already written")
+            return
+        raise
+
+
+def list_deltas() -> list[str]:
+    """
+    Returns the keys of every delta not yet deleted, oldest first.
+    """
+    keys = []
+    params = {"Bucket": SNAPSHOT_BUCKET, "Prefix": DELTA_PREFIX}
+
+    while True:
+        response = s3.list_objects_v2(**params)
+        keys.extend(item["Key"] for item in response.get("Contents", []))
+
+        if not response.get("IsTruncated"):
+            break
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+    return sorted(keys)
+
+
+def load_delta(key: str) -> list[dict]:
+    response = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=key)
+    return [json.loads(line) for line in response["Body"].iter_lines() if line]
+
+
+def delete_deltas(keys: list[str]) -> list[str]:
+    """
+    Deletes folded deltas and returns the keys that could not be deleted.
+    """
+    failed = []
+    for start in range(0, len(keys), MAX_DELETE_KEYS):
+        batch = keys[start : start + MAX_DELETE_KEYS]
+        response = s3.delete_objects(
+            Bucket=SNAPSHOT_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        failed.extend(error["Key"] for error in response.get("Errors", []))
+    return failed
@@ -1,88 +1,717 @@
 import json
 import logging
 import os
-from datetime import datetime
+from contextlib import closing
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable
+from zoneinfo import ZoneInfo
 import boto3
+import dynamo
+import pacing
+import pipeline
+import s3
+import sns
+import weather
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+lambda_client = boto3.client("lambda")
 
-sns = boto3.client("sns")
-dynamodb = boto3.client("dynamodb")
+# Stop taking new pages and hand over to a fresh invocation below this
+RESUME_THRESHOLD_MS = int(os.environ.get("DISPATCH_RESUME_THRESHOLD_MS", "8000"))
+MAX_RESUMES = int(os.environ.get("DISPATCH_MAX_RESUMES", "50"))
+# More than 1 turns a scheduled invocation into a planner that splits the
+# index shards across this many worker invocations
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "1"))
+# Local hour at which subscribers get their forecast, in their own timezone
+SEND_LOCAL_HOUR = int(os.environ.get("SEND_LOCAL_HOUR", "5"))
+# "location" walks the LOCATION reverse index instead of the subscriber index,
+# "join" scans the subscriptions once and publishes jobs carrying the cities,
+# "snapshot" reads subscribers and cities from the S3 snapshot instead
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "")
+HYDRATED_JOB_CHUNK = 500
 
-SNS_TOPIC_ARN = os.environ["WEATHER_FANOUT_TOPIC"]
-DYNAMO_TABLE = os.environ["DYNAMO_TABLE_NAME"]
 
+def time_is_low(context, wait_seconds: float = 0.0) -> bool:
+    """
+    True if less than RESUME_THRESHOLD_MS would be left after waiting
+    `wait_seconds`, e.g. for the pacer.
+    """
+    if context is None:
+        return False
+    remaining_ms = context.get_remaining_time_in_millis() - wait_seconds * 1000
+    return remaining_ms < RESUME_THRESHOLD_MS
 
-def deserialize_item(item):
-    return {k: list(v.values())[0] for k, v in item.items()}
+
+def invoke_self(context, payload: dict):
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(payload).encode("utf-8"),
+    )
+
+
+def run_start(event: dict) -> datetime:
+    """
+    The hour a run belongs to. Taken from the schedule's event time when
+    present, so a delayed or retried trigger still lands in its own hour.
+    """
+    if event.get("runId"):
+        started = datetime.strptime(event["runId"], "%Y-%m-%dT%H")
+        return started.replace(tzinfo=timezone.utc)
+    if event.get("time"):
+        started = datetime.fromisoformat(event["time"].replace("Z", "+00:00"))
+    else:
+        started = datetime.now(timezone.utc)
+    return started.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def due_timezones(started: datetime) -> list[str]:
+    """
+    Timezones whose local time is SEND_LOCAL_HOUR during the run's hour.
+    """
+    return [
+        tz
+        for tz in dynamo.load_timezones()
+        if started.astimezone(ZoneInfo(tz)).hour == SEND_LOCAL_HOUR
+    ]
+
+
+def local_run_dates(started: datetime, timezones: list[str]) -> dict[str, str]:
+    return {
+        tz: started.astimezone(ZoneInfo(tz)).strftime("%Y-%m-%d") for tz in timezones
+    }
+
+
+def split_partitions(partitions: list[str], workers: int) -> list[list[str]]:
+    workers = max(1, min(workers, len(partitions)))
+    return [partitions[i::workers] for i in range(workers)]
+
+
+def plan_run(run_id: str, timezones: list[str], context) -> dict:
+    """
+    Splits the index shards into segments and starts one worker invocation
+    per segment, after one for the priority partition. Every invoked worker
+    is recorded on the run summary, so a retried trigger starts only the
+    workers a failed planner did not get to. The last worker to finish
+    writes the run summary.
+    """
+    partitions = [
+        partition
+        for partition in dynamo.active_partitions()
+        if partition != dynamo.PRIORITY_PARTITION
+    ]
+    segments = split_partitions(partitions, DISPATCH_WORKERS)
+    # The priority partition is one more worker, started first
+    workers = [(len(segments), [dynamo.PRIORITY_PARTITION]), *enumerate(segments)]
+
+    invoked = set()
+    if not dynamo.create_run_summary(run_id, len(workers)):
+        invoked = dynamo.get_invoked_workers(run_id)
+        if len(invoked) >= len(workers):
+            logger.info(f"Run {run_id} already planned, not starting workers again")
+            return {"runId": run_id, "status": "already planned"}
+        logger.info(f"Run {run_id} partly planned, starting the missing workers")
+
+    for worker, partitions in workers:
+        if worker in invoked:
+            continue
+        invoke_self(
+            context,
+            {
+                "mode": "work",
+                "runId": run_id,
+                "timezones": timezones,
+                "worker": worker,
+                "workers": len(workers),
+                "partitions": partitions,
+            },
+        )
+        dynamo.mark_worker_invoked(run_id, worker)
+
+    logger.info(f"Planned run {run_id} across {len(workers)} workers")
+    return {
+        "runId": run_id,
+        "workers": len(workers),
+        "started": len(workers) - len(invoked),
+        "status": "planned",
+    }
+
+
+def run_worker(run_id: str, timezones: list[str], context, event: dict) -> dict:
+    result = dispatch_partitions(
+        run_id, event["partitions"], timezones, context, event
+    )
+    # The last worker to finish aggregates the run
+    if result["status"] != "resumed":
+        if dynamo.finish_worker(run_id, event["worker"]) == 0:
+            summarize_run(run_id)
+    return result
+
+
+def summarize_run(run_id: str):
+    checkpoints = dynamo.load_checkpoints(run_id)
+    published = sum(c.published for c in checkpoints.values())
+    failed = sum(c.failed for c in checkpoints.values())
+    dynamo.complete_run_summary(run_id, published, failed)
+
+    logger.info(
+        f"Run {run_id} complete\n"
+        f"Dispatched Count: {published}\n"
+        f"Failed count: {failed}\n"
+        f"Segments: {len(checkpoints)}"
+    )
+
+
+def publish_claimed(jobs: list[dict]) -> tuple[sns.PublishStats, int]:
+    """
+    Publishes the jobs whose subscribers were not dispatched in their run
+    yet. Returns the publish stats and the number of duplicates skipped.
+    """
+    # Subscribers already dispatched in this run cost one write, nothing more
+    claimed = dynamo.claim_jobs(jobs)
+    stats = sns.publish_jobs(claimed)
+    failed = set()
+    for job in stats.failed_jobs:
+        for email in sns.job_emails(job):
+            failed.add(email)
+            dynamo.release_ledger(job["runDate"], email)
+    stats.failed_jobs.clear()
+    # A claim left PENDING by a crash lapses, so the retried run sends it
+    dynamo.complete_ledgers(
+        [(job["runDate"], job["email"]) for job in claimed if job["email"] not in failed]
+    )
+    return stats, len(jobs) - len(claimed)
+
+
+def pacing_chunks(jobs: list[dict]):
+    """
+    Splits jobs into chunks of one full PublishBatch when the pacer is on,
+    so the wait of each chunk can be checked before it starts.
+    """
+    if not pacing.pacer.active():
+        yield jobs
+        return
+    size = sns.MAX_BATCH_ENTRIES * max(sns.ENVELOPE_SIZE, 1)
+    for start in range(0, len(jobs), size):
+        yield jobs[start : start + size]
 
 
-def get_all_subscribers():
-    subscribers = []
-    last_evaluated_key = None
+def publish_paced(jobs: list[dict], context) -> tuple[sns.PublishStats, int, bool]:
+    """
+    Publishes jobs like publish_claimed, one pacing chunk at a time. Stops
+    before a chunk whose pacing wait would run into RESUME_THRESHOLD_MS and
+    returns handed_over=True; the jobs left are neither claimed nor
+    published. Returns (stats, duplicates, handed_over).
+    """
+    stats = sns.PublishStats()
+    duplicates = 0
+    for chunk in pacing_chunks(jobs):
+        # Single-subscriber jobs are packed, one weather token per envelope
+        plain = sum(1 for job in chunk if "cities" not in job)
+        hydrated = sum(1 for job in chunk if "cities" in job and pacing.needs_weather(job))
+        fetches = -(-plain // max(sns.ENVELOPE_SIZE, 1)) + hydrated
+        if time_is_low(context, pacing.pacer.delay(len(chunk), fetches)):
+            return stats, duplicates, True
 
-    while True:
-        params = {
-            "TableName": DYNAMO_TABLE,
-            "KeyConditionExpression": "PK = :pk",
-            "ExpressionAttributeValues": {":pk": {"S": "PROFILE"}},
+        chunk_stats, chunk_duplicates = publish_claimed(chunk)
+        stats.merge(chunk_stats)
+        duplicates += chunk_duplicates
+    return stats, duplicates, False
+
+
+def dispatch_partitions(
+    run_id: str,
+    partitions: list[str],
+    timezones: list[str],
+    context,
+    event: dict,
+):
+    """
+    Publishes the jobs of the given index shards for the due timezone
+    buckets, resuming each segment from its checkpoint. Hands over to a
+    fresh invocation when time runs low.
+    """
+    resumes = int(event.get("resumes", 0))
+    run_dates = local_run_dates(run_start({"runId": run_id}), timezones)
+
+    checkpoints = dynamo.load_checkpoints(run_id)
+    pending = {}
+    previously_published = 0
+    for partition in partitions:
+        for tz in timezones:
+            checkpoint = checkpoints.get(
+                dynamo.segment_key(partition, tz), dynamo.Checkpoint()
+            )
+            previously_published += checkpoint.published
+            if not checkpoint.done:
+                pending[(partition, tz)] = checkpoint
+
+    if not pending:
+        logger.info(f"Segments of run {run_id} already complete")
+        return {
+            "runId": run_id,
+            "subscribers": previously_published,
+            "status": "complete",
         }
 
-        if last_evaluated_key:
-            params["ExclusiveStartKey"] = last_evaluated_key
+    if checkpoints:
+        logger.info(
+            f"Resuming run {run_id}: {len(pending)} segments pending, "
+            f"{previously_published} jobs already published"
+        )
+
+    stats = sns.PublishStats()
+    subscriber_count = 0
+    pages = 0
+    duplicates = 0
+    handed_over = False
 
-        response = dynamodb.query(**params)
+    # The priority partition is read to the end before any other shard.
+    # Within a phase all segments are queried in parallel, and the next pages
+    # are fetched while the jobs from the current page are being published.
+    phases = [
+        [key for key in pending if key[0] == dynamo.PRIORITY_PARTITION],
+        [key for key in pending if key[0] != dynamo.PRIORITY_PARTITION],
+    ]
+    for phase in phases:
+        if handed_over or not phase:
+            continue
+        segments = [
+            dynamo.iter_subscriber_pages(partition, tz, pending[(partition, tz)].cursor)
+            for partition, tz in phase
+        ]
+        with closing(pipeline.merge(segments)) as stream:
+            for page in stream:
+                pages += 1
+                subscriber_count += len(page.emails)
+                job = {"runDate": run_dates[page.timezone]}
+                if page.partition == dynamo.PRIORITY_PARTITION:
+                    job["priority"] = True
+                jobs = [{"email": email, **job} for email in page.emails]
+                page_stats, page_duplicates, paced_out = publish_paced(jobs, context)
+                duplicates += page_duplicates
+                stats.merge(page_stats)
+                # A page cut short is read again; its ledger skips what went out
+                dynamo.save_checkpoint(
+                    run_id,
+                    page,
+                    page_stats.published,
+                    page_stats.failed,
+                    advance=not paced_out,
+                )
 
-        for item in response.get("Items", []):
-            user = deserialize_item(item)
-            print("USER FOUND: ", user.get("email", "NO EMAIL"))
-            print("USER ACTIVE?: ", user.get("isActive", "isActive NOT FOUND"))
-            if user.get("isActive", False):
-                subscribers.append(user["email"])
+                if paced_out or time_is_low(context):
+                    handed_over = True
+                    break
+
+    if handed_over:
+        if resumes >= MAX_RESUMES:
+            logger.error(f"Run {run_id} hit DISPATCH_MAX_RESUMES={MAX_RESUMES}")
+        else:
+            logger.info(f"Time budget low, continuing run {run_id} in a new invocation")
+            invoke_self(
+                context,
+                {
+                    **event,
+                    "runId": run_id,
+                    "timezones": timezones,
+                    "resumes": resumes + 1,
+                },
+            )
+
+    logger.info(
+        f"Run: {run_id}\n"
+        f"Timezones: {timezones}\n"
+        f"Dispatched Count: {stats.published}\n"
+        f"Retried count: {stats.retried}\n"
+        f"Failed count: {stats.failed}\n"
+        f"Duplicates skipped: {duplicates}\n"
+        f"Subscriber count: {subscriber_count}\n"
+        f"Pages: {pages}\n"
+        f"Run total published: {previously_published + stats.published}"
+    )
+    return {
+        "runId": run_id,
+        "subscribers": stats.published,
+        "retried": stats.retried,
+        "failed": stats.failed,
+        "duplicates": duplicates,
+        "runPublished": previously_published + stats.published,
+        "status": "resumed" if handed_over else "dispatched",
+    }
 
-        last_evaluated_key = response.get("LastEvaluatedKey")
 
-        if not last_evaluated_key:
+def collect_due_subscribers(
+    timezones: list[str], run_dates: dict[str, str]
+) -> dict[str, dict]:
+    """
+    Reads every index segment of the due timezones and returns a job stub
+    per active subscriber of the run: its email, local runDate and whether
+    it is in the priority lane.
+    """
+    active = {}
+    segments = [
+        dynamo.iter_subscriber_pages(partition, tz)
+        for partition in dynamo.active_partitions()
+        for tz in timezones
+    ]
+    with closing(pipeline.merge(segments)) as stream:
+        for page in stream:
+            for email in page.emails:
+                job = {"email": email, "runDate": run_dates[page.timezone]}
+                if page.partition == dynamo.PRIORITY_PARTITION:
+                    job["priority"] = True
+                active[email] = job
+    return active
+
+
+def publish_hydrated(
+    run_id: str,
+    jobs: Iterable[dict],
+    timezones: list[str],
+    context,
+    event: dict,
+    spill: bool = True,
+) -> tuple[sns.PublishStats, int, bool]:
+    """
+    Publishes jobs that carry their cities in chunks as they are read from
+    `jobs`, handing the run over to a new invocation when time runs low.
+    With `spill` the jobs not yet published are stored in S3 for that
+    invocation; without it, it is told how many jobs to skip. Either way
+    the ledger lets it skip the ones of the interrupted chunk that already
+    went out. Returns (stats, duplicates, handed_over).
+    """
+    resumes = int(event.get("resumes", 0))
+    stats = sns.PublishStats()
+    duplicates = 0
+    handed_over = False
+    consumed = 0
+
+    jobs = iter(jobs)
+    chunk = list(islice(jobs, HYDRATED_JOB_CHUNK))
+    while chunk:
+        chunk_stats, chunk_duplicates, paced_out = publish_paced(chunk, context)
+        stats.merge(chunk_stats)
+        duplicates += chunk_duplicates
+        if paced_out:
+            handed_over = True
             break
 
-    return subscribers
+        consumed += len(chunk)
+        chunk = list(islice(jobs, HYDRATED_JOB_CHUNK))
+        if chunk and time_is_low(context):
+            handed_over = True
+            break
 
+    if handed_over and resumes < MAX_RESUMES:
+        logger.info(f"Time budget low, continuing run {run_id} in a new invocation")
+        resume = {
+            **event,
+            "runId": run_id,
+            "timezones": timezones,
+            "resumes": resumes + 1,
+        }
+        if not spill:
+            resume["skip"] = int(event.get("skip", 0)) + consumed
+        else:
+            try:
+                resume["jobsKey"] = s3.save_run_jobs(run_id, [*chunk, *jobs])
+            except Exception:
+                # Without the stored jobs the next invocation rebuilds them
+                logger.exception(f"Failed to store the remaining jobs of run {run_id}")
+                resume.pop("jobsKey", None)
+        invoke_self(context, resume)
+
+    return stats, duplicates, handed_over
+
+
+def load_handed_over_jobs(event: dict) -> list[dict] | None:
+    """
+    Returns the jobs a handed-over run stored for this invocation, or None
+    if there are none and the jobs have to be built.
+    """
+    if not event.get("jobsKey"):
+        return None
+    try:
+        jobs = list(s3.iter_run_jobs(event["jobsKey"]))
+    except Exception:
+        logger.exception(f"Failed to read the handed-over jobs {event['jobsKey']}")
+        return None
+    logger.info(f"Resuming with {len(jobs)} handed-over jobs")
+    return jobs
 
-def lambda_handler(event, context):
-    logger.info("WeatherDispatcherFunction invoked")
 
-    subscribers = get_all_subscribers()
-    logger.info(f"Found {len(subscribers)} subscribers")
-    print("SUBSCRIBERS: ", subscribers)
+def location_city(location: dict, forecast) -> dict:
+    """
+    Returns the hydrated city of a location. A location whose fetch failed
+    goes out with its coordinates and no forecast, so send_forecast fetches
+    it again instead of sending an empty forecast.
+    """
+    if not forecast:
+        return {
+            "city": location["city"],
+            "state": location["state"],
+            "lat": location["lat"],
+            "lon": location["lon"],
+            "timezone": location["timezone"],
+        }
+    # Jobs carry the forecast as its columns, not a dict per day
+    return {
+        "city": location["city"],
+        "state": location["state"],
+        "forecast": forecast.to_json(),
+    }
 
-    published = 0
 
-    for email in subscribers:
-        try:
-            message = {
-                "email": email,
-                "runDate": datetime.strftime(datetime.now(), "%Y-%m-%d"),
-            }
-            print("MESSAGE: ", message)
+def dispatch_locations(run_id: str, timezones: list[str], context, event: dict):
+    """
+    Walks the LOCATION reverse index, fetches each location's forecast once
+    and publishes jobs that already carry every city's forecast, so
+    send_forecast needs neither DynamoDB nor Open-Meteo. Weather calls grow
+    with the number of locations, not with the number of subscriptions.
+    Locations none of whose subscribers is due are not read.
+    """
+    forecasts = {}
+    jobs = load_handed_over_jobs(event)
+    if jobs is None:
+        run_dates = local_run_dates(run_start({"runId": run_id}), timezones)
+        active = collect_due_subscribers(timezones, run_dates)
 
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Message=json.dumps(message),
+        due_timezones = set(timezones)
+        skipped = 0
+        subscriptions = {email: [] for email in active}
+        for page in dynamo.iter_location_pages():
+            # Locations written before subscriberTimezones existed are always read
+            locations = [
+                location
+                for location in page
+                if not location["subscriberTimezones"]
+                or location["subscriberTimezones"] & due_timezones
+            ]
+            skipped += len(page) - len(locations)
+
+            subscribers = dynamo.executor.map(
+                lambda location: dynamo.get_location_subscribers(location["key"]),
+                locations,
             )
+            wanted = []
+            for location, emails in zip(locations, subscribers):
+                due = [email for email in emails if email in active]
+                for email in due:
+                    subscriptions[email].append(location["key"])
+                if due:
+                    wanted.append(location)
+
+            # One forecast fetch per page of locations, never per subscriber
+            if not wanted:
+                continue
+            pacing.pacer.acquire_weather()
+            for location, entry in zip(wanted, weather.build_forecast_payload(wanted)):
+                forecasts[location["key"]] = location_city(location, entry["forecast"])
+
+        logger.info(
+            f"Fetched {len(forecasts)} location forecasts for {len(active)} "
+            f"subscribers, skipped {skipped} locations with none due"
+        )
 
-            published += 1
+        jobs = [
+            {**active[email], "cities": [forecasts[key] for key in keys]}
+            for email, keys in subscriptions.items()
+            # Active subscribers without a location have nothing to send
+            if keys
+        ]
+        # Priority jobs are published in the first chunks
+        jobs.sort(key=lambda job: not job.get("priority"))
 
-        except Exception:
-            logger.exception("Failed to dispatch weather job for %s", email)
+    stats, duplicates, handed_over = publish_hydrated(
+        run_id, jobs, timezones, context, {**event, "mode": "location"}
+    )
 
     logger.info(
-        f"Dispatched Count: {published}\n"
-        f"Subscriber count: {len(subscribers)}\n"
-        f"Subscribers: {subscribers}"
+        f"Run: {run_id}\n"
+        f"Timezones: {timezones}\n"
+        f"Locations fetched: {len(forecasts)}\n"
+        f"Dispatched Count: {stats.published}\n"
+        f"Retried count: {stats.retried}\n"
+        f"Failed count: {stats.failed}\n"
+        f"Duplicates skipped: {duplicates}"
+    )
+    return {
+        "runId": run_id,
+        "subscribers": stats.published,
+        "retried": stats.retried,
+        "failed": stats.failed,
+        "duplicates": duplicates,
+        "locations": len(forecasts),
+        "status": "resumed" if handed_over else "dispatched",
+    }
+
+
+def dispatch_joined(run_id: str, timezones: list[str], context, event: dict):
+    """
+    Joins the due subscribers with their subscriptions in memory, read from
+    the shards of SubscriptionIndex in parallel instead of one Query per
+    subscriber, and publishes
+    jobs carrying each subscriber's cities and coordinates, so
+    send_forecast does not read DynamoDB.
+    """
+    jobs = load_handed_over_jobs(event)
+    if jobs is None:
+        run_dates = local_run_dates(run_start({"runId": run_id}), timezones)
+        active = collect_due_subscribers(timezones, run_dates)
+
+        cities = {}
+        segments = [
+            dynamo.iter_subscription_pages(partition)
+            for partition in dynamo.subscription_partitions()
+        ]
+        with closing(pipeline.merge(segments)) as stream:
+            for page in stream:
+                for email, city in page:
+                    if email in active:
+                        cities.setdefault(email, []).append(city)
+
+        logger.info(
+            f"Joined {sum(map(len, cities.values()))} subscriptions "
+            f"for {len(active)} subscribers"
+        )
+
+        jobs = [
+            {**active[email], "cities": email_cities}
+            for email, email_cities in cities.items()
+        ]
+        jobs.sort(key=lambda job: not job.get("priority"))
+    stats, duplicates, handed_over = publish_hydrated(
+        run_id, jobs, timezones, context, {**event, "mode": "join"}
+    )
+
+    logger.info(
+        f"Run: {run_id}\n"
+        f"Timezones: {timezones}\n"
+        f"Dispatched Count: {stats.published}\n"
+        f"Retried count: {stats.retried}\n"
+        f"Failed count: {stats.failed}\n"
+        f"Duplicates skipped: {duplicates}"
     )
     return {
-        "statusCode": 200,
-        "body": json.dumps({"subscribers": published, "status": "dispatched"}),
+        "runId": run_id,
+        "subscribers": stats.published,
+        "retried": stats.retried,
+        "failed": stats.failed,
+        "duplicates": duplicates,
+        "status": "resumed" if handed_over else "dispatched",
     }
+
+
+def snapshot_jobs(records, run_dates: dict[str, str]):
+    """
+    Yields the job of every active subscriber of the snapshot in a due
+    timezone, in the order of the snapshot.
+    """
+    for record in records:
+        tz = record.get("timezone") or dynamo.DEFAULT_TIMEZONE
+        if not record.get("active") or tz not in run_dates or not record["cities"]:
+            continue
+        job = {
+            "email": record["email"],
+            "runDate": run_dates[tz],
+            "cities": list(record["cities"].values()),
+        }
+        if record.get("priority"):
+            job["priority"] = True
+        yield job
+
+
+def dispatch_snapshot(run_id: str, timezones: list[str], context, event: dict):
+    """
+    Streams the S3 subscriber snapshot with one GET instead of querying the
+    index and subscriptions, and publishes jobs carrying the cities of
+    every active subscriber in a due timezone, a chunk at a time as the
+    lines are read. Priority jobs go out on their own topic as they come.
+    A handed-over run reads the same snapshot version again and skips the
+    jobs published before.
+    """
+    run_dates = local_run_dates(run_start({"runId": run_id}), timezones)
+    version_id, records = s3.open_snapshot(event.get("snapshotVersion"))
+    skip = int(event.get("skip", 0))
+    jobs = islice(snapshot_jobs(records, run_dates), skip, None)
+    if skip:
+        logger.info(f"Resuming after {skip} jobs of snapshot version {version_id}")
+
+    stats, duplicates, handed_over = publish_hydrated(
+        run_id,
+        jobs,
+        timezones,
+        context,
+        {**event, "mode": "snapshot", "snapshotVersion": version_id},
+        spill=False,
+    )
+
+    logger.info(
+        f"Run: {run_id}\n"
+        f"Timezones: {timezones}\n"
+        f"Dispatched Count: {stats.published}\n"
+        f"Retried count: {stats.retried}\n"
+        f"Failed count: {stats.failed}\n"
+        f"Duplicates skipped: {duplicates}"
+    )
+    return {
+        "runId": run_id,
+        "subscribers": stats.published,
+        "retried": stats.retried,
+        "failed": stats.failed,
+        "duplicates": duplicates,
+        "status": "resumed" if handed_over else "dispatched",
+    }
+
+
+def lambda_handler(event, context):
+    logger.info("WeatherDispatcherFunction invoked")
+    event = event or {}
+
+    started = run_start(event)
+    run_id = started.strftime("%Y-%m-%dT%H")
+    # Workers of a planned run split the pacing rates between them
+    pacing.pacer.set_shares(event.get("workers", 1))
+    mode = (
+        event.get("mode")
+        or DISPATCH_MODE
+        or ("plan" if DISPATCH_WORKERS > 1 else "single")
+    )
+
+    # Workers and resumed invocations keep the buckets their run started with
+    timezones = event.get("timezones")
+    if timezones is None:
+        timezones = due_timezones(started)
+
+    if not timezones:
+        logger.info(f"No timezone is due at {SEND_LOCAL_HOUR}:00 local in run {run_id}")
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"runId": run_id, "status": "nothing due"}),
+        }
+
+    if mode == "plan":
+        result = plan_run(run_id, timezones, context)
+
+    elif mode == "location":
+        result = dispatch_locations(run_id, timezones, context, event)
+
+    elif mode == "join":
+        result = dispatch_joined(run_id, timezones, context, event)
+
+    elif mode == "snapshot":
+        result = dispatch_snapshot(run_id, timezones, context, event)
+
+    elif mode == "work":
+        result = run_worker(run_id, timezones, context, event)
+
+    else:
+        result = dispatch_partitions(
+            run_id, dynamo.active_partitions(), timezones, context, event
+        )
+
+    return {"statusCode": 200, "body": json.dumps(result)}
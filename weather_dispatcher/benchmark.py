@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# A Query page of KEYS_ONLY index entries holds about this many subscribers
+SYNTHETIC_PAGE_SIZE = 1000
+
+
+@dataclass(slots=True)
+class Stage:
+    seconds: float = 0.0
+    calls: int = 0
+    items: int = 0
+
+
+@dataclass(slots=True)
+class StageTimer:
+    stages: dict[str, Stage] = field(default_factory=dict)
+    # Publish stages are timed from the publishing threads
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._add(name, time.perf_counter() - started, items)
+
+    def _add(self, name: str, seconds: float, items: int):
+        stage = self.stages.setdefault(name, Stage())
+        stage.seconds += seconds
+        stage.calls += 1
+        stage.items += items
+
+    def report(self) -> dict:
+        return {
+            name: {
+                "seconds": round(stage.seconds, 4),
+                "calls": stage.calls,
+                "items": stage.items,
+            }
+            for name, stage in self.stages.items()
+        }
+
+
+def synthetic_pages(
+    partition: str,
+    timezone: str,
+    count: int,
+    page_size: int = SYNTHETIC_PAGE_SIZE,
+    latency_ms: int = 0,
+):
+    """
+    Yields SubscriberPage objects like iter_subscriber_pages would, for
+    `count` made-up subscribers. `latency_ms` stands in for a Query round
+    trip.
+    """
+    # Imported here so running this file can set their environment first
+    import dynamo
+
+    for start in range(0, count, page_size):
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        emails = [
+            f"{partition.lower()}-{n}@example.com"
+            for n in range(start, min(start + page_size, count))
+        ]
+        last = start + page_size >= count
+        cursor = None if last else {"activeSK": {"S": f"{timezone}#{emails[-1]}"}}
+        yield dynamo.SubscriberPage(partition, timezone, emails, cursor)
+
+
+@contextmanager
+def replaced(*replacements):
+    """
+    Sets each (object, attribute, value) for the duration of the block and
+    puts the originals back afterwards, so a warm container is left as it
+    was found.
+    """
+    originals = [(obj, name, getattr(obj, name)) for obj, name, _ in replacements]
+    for obj, name, value in replacements:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+
+
+def timed(timer: StageTimer, name: str, func, latency_ms: int = 0, items=None):
+    """
+    Wraps `func` so every call is timed as stage `name`, after sleeping
+    `latency_ms` in place of an AWS round trip. `items` counts the items of
+    a call from its first argument.
+    """
+
+    def call(*args, **kwargs):
+        with timer.stage(name, items(args[0]) if items else 0):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            return func(*args, **kwargs)
+
+    return call
+
+
+class DrySNS:
+    """
+    Stands in for the SNS client: every entry succeeds.
+    """
+
+    def __init__(self, timer: StageTimer, latency_ms: int):
+        self.timer = timer
+        self.latency_ms = latency_ms
+        self.batches = 0
+        self.payload_bytes = 0
+        self.lock = threading.Lock()
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        entries = PublishBatchRequestEntries
+        with self.timer.stage("publish_batch", len(entries)):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+        with self.lock:
+            self.batches += 1
+            self.payload_bytes += sum(len(e["Message"].encode("utf-8")) for e in entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in entries]}
+
+    def publish(self, TopicArn, Message):
+        return {}
+
+
+class DryContext:
+    """
+    A Lambda context whose remaining time counts down from `budget_ms`.
+    """
+
+    function_name = "dry-run"
+    invoked_function_arn = "dry-run"
+
+    def __init__(self, budget_ms: int):
+        self.ends_at = time.monotonic() + budget_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.ends_at - time.monotonic()) * 1000)
+
+
+def dry_run(event: dict) -> dict:
+    """
+    Runs the real dispatch_partitions against synthetic subscribers, with
+    DynamoDB, SNS and the self-invocation replaced by stubs. Pages are
+    merged and prefetched, claimed in the ledger, paced, packed, published
+    and checkpointed by the real code, and each stub only sleeps its
+    simulated latency. Returns the time spent per stage.
+    """
+    import app
+    import dynamo
+    import pacing
+    import pipeline
+    import sns
+
+    subscribers = int(event.get("subscribers", 10_000))
+    page_size = int(event.get("pageSize", SYNTHETIC_PAGE_SIZE))
+    query_latency_ms = int(event.get("queryLatencyMs", 0))
+    publish_latency_ms = int(event.get("publishLatencyMs", 0))
+    # One conditional write per claim, and per checkpoint or ledger batch
+    write_latency_ms = int(event.get("writeLatencyMs", 0))
+    # SES sends per second to pace to, as from the send quota; none by default
+    ses_rate = float(event.get("sesRate", 0))
+    budget_ms = int(event.get("budgetMs", 900_000))
+    timezone = event.get("timezone", dynamo.DEFAULT_TIMEZONE)
+    # Run ids are the UTC hour of the run; only the local run dates use it
+    run_id = event.get("runId", "2025-12-26T10")
+
+    partitions = dynamo.index_partitions()
+    per_partition, extra = divmod(subscribers, len(partitions))
+    counts = {
+        partition: per_partition + (1 if idx < extra else 0)
+        for idx, partition in enumerate(partitions)
+    }
+
+    timer = StageTimer()
+    sink = DrySNS(timer, publish_latency_ms)
+    handovers = []
+    page_count = 0
+    merge = pipeline.merge
+
+    def timed_merge(segments):
+        nonlocal page_count
+        stream = merge(segments)
+        try:
+            while True:
+                # Time spent waiting for the next page, i.e. not hidden by prefetch
+                with timer.stage("query_page"):
+                    page = next(stream, None)
+                if page is None:
+                    return
+                page_count += 1
+                yield page
+        finally:
+            stream.close()
+
+    def claim_ledger(run_date, email, stage="DISPATCH"):
+        if write_latency_ms:
+            time.sleep(write_latency_ms / 1000)
+        return True
+
+    def pages(partition, tz, start_key=None):
+        return synthetic_pages(
+            partition, tz, counts[partition], page_size, query_latency_ms
+        )
+
+    pacer = pacing.Pacer()
+    pacer.ready = True
+    if ses_rate:
+        pacer.ses = pacing.TokenBucket(ses_rate)
+    if pacing.OPEN_METEO_RPM > 0:
+        pacer.weather = pacing.TokenBucket(pacing.OPEN_METEO_RPM / 60)
+    pacer.acquire_jobs = timed(timer, "pacing", pacer.acquire_jobs, items=len)
+
+    stubs = [
+        (pipeline, "merge", timed_merge),
+        (dynamo, "iter_subscriber_pages", pages),
+        (dynamo, "load_checkpoints", timed(timer, "load_checkpoints", lambda run_id: {})),
+        (dynamo, "claim_ledger", claim_ledger),
+        (dynamo, "claim_jobs", timed(timer, "claim_jobs", dynamo.claim_jobs, items=len)),
+        (
+            dynamo,
+            "complete_ledgers",
+            timed(timer, "complete_ledgers", lambda *a, **k: None, write_latency_ms, len),
+        ),
+        (dynamo, "release_ledger", lambda *args, **kwargs: None),
+        (
+            dynamo,
+            "save_checkpoint",
+            timed(timer, "save_checkpoint", lambda *a, **k: None, write_latency_ms),
+        ),
+        (sns, "sns", sink),
+        (sns, "publish_jobs", timed(timer, "publish_jobs", sns.publish_jobs, items=len)),
+        (pacing, "pacer", pacer),
+        (app, "invoke_self", lambda context, payload: handovers.append(payload)),
+    ]
+
+    started = time.perf_counter()
+    with replaced(*stubs):
+        dispatched = app.dispatch_partitions(
+            run_id, partitions, [timezone], DryContext(budget_ms), {}
+        )
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "dryRun": True,
+        "subscribers": subscribers,
+        "published": dispatched.get("subscribers", 0),
+        "pages": page_count,
+        "publishBatches": sink.batches,
+        "payloadBytes": sink.payload_bytes,
+        "handedOver": bool(handovers),
+        "seconds": round(elapsed, 4),
+        "subscribersPerSecond": round(subscribers / elapsed) if elapsed else None,
+        "stages": timer.report(),
+    }
+    logger.info(f"Dry run: {json.dumps(result)}")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark a dispatch dry run")
+    parser.add_argument("subscribers", type=int, nargs="?", default=10_000)
+    parser.add_argument("--page-size", type=int, default=SYNTHETIC_PAGE_SIZE)
+    parser.add_argument("--query-latency-ms", type=int, default=0)
+    parser.add_argument("--publish-latency-ms", type=int, default=0)
+    parser.add_argument("--write-latency-ms", type=int, default=0)
+    parser.add_argument("--ses-rate", type=float, default=0)
+    parser.add_argument("--budget-ms", type=int, default=900_000)
+    args = parser.parse_args()
+
+    # The modules read these at import; nothing is sent anywhere
+    os.environ.setdefault("DYNAMO_TABLE_NAME", "dry-run")
+    os.environ.setdefault("WEATHER_FANOUT_TOPIC", "dry-run")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    result = dry_run(
+        {
+            "subscribers": args.subscribers,
+            "pageSize": args.page_size,
+            "queryLatencyMs": args.query_latency_ms,
+            "publishLatencyMs": args.publish_latency_ms,
+            "writeLatencyMs": args.write_latency_ms,
+            "sesRate": args.ses_rate,
+            "budgetMs": args.budget_ms,
+        }
+    )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Consecutive failures that open the circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+# How long an open circuit fails fast before one probe call is let through
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+# "true" shares open circuits between containers through the DynamoDB table
+CIRCUIT_SHARED = os.environ.get("CIRCUIT_SHARED", "false").lower() == "true"
+# How often a container looks at the shared state while its own is closed
+CIRCUIT_SYNC_SECONDS = float(os.environ.get("CIRCUIT_SYNC_SECONDS", "5"))
+DYNAMO_TABLE = os.environ.get("DYNAMO_TABLE_NAME")
+
+dynamodb = boto3.client("dynamodb") if CIRCUIT_SHARED and DYNAMO_TABLE else None
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an endpoint fast once it has failed
+    CIRCUIT_FAILURE_THRESHOLD times in a row. After CIRCUIT_OPEN_SECONDS a
+    single probe call is let through (half-open): success closes the
+    circuit, failure opens it again. With CIRCUIT_SHARED an open circuit is
+    written to DynamoDB, so other containers stop calling too.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError unless the call may go ahead.
+        """
+        now = time.time()
+        with self.lock:
+            if not self.open_until and dynamodb is not None:
+                self._sync(now)
+            if not self.open_until:
+                return
+            if now < self.open_until or self.probing:
+                raise CircuitOpenError(
+                    f"{self.name} is temporarily unavailable, try again later"
+                )
+            # Half-open: this call is the probe, the others keep failing fast
+            self.probing = True
+            logger.info(f"Circuit {self.name}: probing")
+
+    def record_success(self):
+        with self.lock:
+            was_open = bool(self.open_until)
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = False
+        if was_open:
+            logger.info(f"Circuit {self.name}: closed")
+            self._share(0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.probing and self.failures < CIRCUIT_FAILURE_THRESHOLD:
+                return
+            self.open_until = time.time() + CIRCUIT_OPEN_SECONDS
+            self.probing = False
+            open_until = self.open_until
+        logger.warning(
+            f"Circuit {self.name}: open for {CIRCUIT_OPEN_SECONDS:.0f}s "
+            f"after {self.failures} failures"
+        )
+        self._share(open_until)
+
+    def record_abandoned(self):
+        """
+        Ends a call that gave up for the caller's own reasons, without
+        counting it either way. A probe lets the next call probe instead.
+        """
+        with self.lock:
+            self.probing = False
+
+    def _sync(self, now: float):
+        if now - self.synced_at < CIRCUIT_SYNC_SECONDS:
+            return
+        self.synced_at = now
+        try:
+            item = dynamodb.get_item(
+                TableName=DYNAMO_TABLE,
+                Key=self._key(),
+                ProjectionExpression="openUntil",
+            ).get("Item")
+        except Exception:
+            logger.exception(f"Circuit {self.name}: failed to read shared state")
+            return
+        if item and float(item["openUntil"]["N"]) > now:
+            self.open_until = float(item["openUntil"]["N"])
+            logger.info(f"Circuit {self.name}: opened by another container")
+
+    def _share(self, open_until: float):
+        if dynamodb is None:
+            return
+        try:
+            if open_until:
+                dynamodb.put_item(
+                    TableName=DYNAMO_TABLE,
+                    Item={
+                        **self._key(),
+                        "openUntil": {"N": str(open_until)},
+                        "expiresAt": {"N": str(int(open_until) + 3600)},
+                    },
+                )
+            else:
+                dynamodb.delete_item(TableName=DYNAMO_TABLE, Key=self._key())
+        except Exception:
+            logger.exception(f"Circuit {self.name}: failed to write shared state")
+
+    def _key(self) -> dict:
+        return {"PK": {"S": f"CIRCUIT#{self.name}"}, "SK": {"S": "STATE"}}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """
+    The container-wide breaker of an endpoint.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,117 @@
+from datetime import date
+from functools import lru_cache
+import constants
+
+# Days of Open-Meteo's daily block that go into an email
+FORECAST_DAYS = 7
+UNKNOWN_CODE = "Unknown Weather Code"
+
+
+@lru_cache(maxsize=64)
+def day_labels(dates: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    "Today", "Tomorrow" and then the weekday of every date. Every city of a
+    run shares the same dates, so this runs about once per run.
+    """
+    weekdays = [date.fromisoformat(date_str).strftime("%A") for date_str in dates[2:]]
+    return ("Today", "Tomorrow", *weekdays)[: len(dates)]
+
+
+class Forecast:
+    """
+    The daily forecast of one location, kept as the columns of Open-Meteo's
+    `daily` block instead of a dict per day. Normalizing a response only
+    slices its columns; labels and descriptions are looked up once per date
+    and code when the forecast is rendered.
+    """
+
+    __slots__ = ("dates", "highs", "lows", "codes")
+
+    def __init__(self, dates=(), highs=(), lows=(), codes=()):
+        self.dates = dates
+        self.highs = highs
+        self.lows = lows
+        self.codes = codes
+
+    @classmethod
+    def from_daily(cls, daily: dict) -> "Forecast":
+        """
+        Takes the first FORECAST_DAYS days of a `daily` block. Raises
+        ValueError if a column is shorter than the dates.
+        """
+        dates = daily.get("time") or []
+        days = min(FORECAST_DAYS, len(dates))
+        columns = [
+            daily.get(name) or []
+            for name in ("temperature_2m_max", "temperature_2m_min", "weathercode")
+        ]
+        if any(len(column) < days for column in columns):
+            raise ValueError("Daily forecast has missing values")
+        highs, lows, codes = (column[:days] for column in columns)
+        return cls(dates[:days], highs, lows, codes)
+
+    @classmethod
+    def load(cls, value) -> "Forecast":
+        """
+        Accepts a Forecast, its `to_json()` form, the list of day dicts that
+        caches and job messages held before, or None.
+        """
+        if isinstance(value, cls):
+            return value
+        if not value:
+            return EMPTY_FORECAST
+        if isinstance(value, dict):
+            return cls.from_daily(value)
+        return cls(
+            [day["date"] for day in value],
+            [day["high"] for day in value],
+            [day["low"] for day in value],
+            [day["code"] for day in value],
+        )
+
+    def to_json(self) -> dict:
+        """
+        The forecast as a `daily` block, which is also its cached and queued
+        form.
+        """
+        return {
+            "time": list(self.dates),
+            "temperature_2m_max": list(self.highs),
+            "temperature_2m_min": list(self.lows),
+            "weathercode": list(self.codes),
+        }
+
+    def days(self):
+        """
+        Returns (label, high, low, description) for every day.
+        """
+        describe = constants.WEATHER_CODE_MAP.get
+        return zip(
+            day_labels(tuple(self.dates)),
+            self.highs,
+            self.lows,
+            [describe(code, UNKNOWN_CODE) for code in self.codes],
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Forecast):
+            return NotImplemented
+        return (
+            self.dates == other.dates
+            and self.highs == other.highs
+            and self.lows == other.lows
+            and self.codes == other.codes
+        )
+
+    # Mutable columns; compared by value but never used as a key
+    __hash__ = None
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __repr__(self) -> str:
+        return f"Forecast({len(self)} days from {self.dates[0] if self.dates else None})"
+
+
+# Stands in for a forecast that could not be fetched
+EMPTY_FORECAST = Forecast()
@@ -0,0 +1,603 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+dynamodb = boto3.client("dynamodb")
+DYNAMO_TABLE = os.environ["DYNAMO_TABLE_NAME"]
+ACTIVE_INDEX = os.environ.get("ACTIVE_SUBSCRIBERS_INDEX", "ActiveSubscribersIndex")
+PROFILE_SHARD_COUNT = int(os.environ.get("PROFILE_SHARD_COUNT", "16"))
+PROFILE_SHARD_MIGRATION = (
+    os.environ.get("PROFILE_SHARD_MIGRATION", "false").lower() == "true"
+)
+LEGACY_ACTIVE_PK = "ACTIVE"
+LEGACY_PROFILE_PK = "PROFILE"
+# Written by manage_subscriptions once every active profile carries its
+# index keys; until then the profile partitions are read instead
+ACTIVE_INDEX_MARKER_KEY = {"PK": {"S": "MIGRATION"}, "SK": {"S": "ACTIVE_INDEX"}}
+# Index partition of high-priority profiles, dispatched before every shard
+PRIORITY_PARTITION = "ACTIVE#PRIORITY"
+LOCATION_PAGE_SIZE = int(os.environ.get("DISPATCH_LOCATION_PAGE_SIZE", "50"))
+# Sparse index of the subscription items, read by join mode
+SUBSCRIPTION_INDEX = os.environ.get("SUBSCRIPTION_INDEX", "SubscriptionIndex")
+CHECKPOINT_TTL_DAYS = int(os.environ.get("DISPATCH_CHECKPOINT_TTL_DAYS", "7"))
+LEDGER_TTL_DAYS = int(os.environ.get("LEDGER_TTL_DAYS", "3"))
+# A PENDING claim whose holder died can be taken over after this long
+LEDGER_LEASE_SECONDS = int(os.environ.get("LEDGER_LEASE_SECONDS", "60"))
+# Index items per Query page, which bounds the claim and publish work of a page
+SUBSCRIBER_PAGE_SIZE = int(os.environ.get("DISPATCH_PAGE_SIZE", "500"))
+DYNAMO_WORKERS = int(os.environ.get("DISPATCH_DYNAMO_WORKERS", "8"))
+# BatchWriteItem request limit
+MAX_BATCH_WRITE = 25
+# Send-time bucket of profiles whose timezone is not known yet
+DEFAULT_TIMEZONE = os.environ.get("DEFAULT_TIMEZONE", "America/New_York")
+
+# Runs independent single-item requests concurrently
+executor = ThreadPoolExecutor(max_workers=DYNAMO_WORKERS)
+
+
+@dataclass(frozen=True, slots=True)
+class SubscriberPage:
+    partition: str
+    timezone: str
+    emails: list[str]
+    # LastEvaluatedKey after this page, None once the segment is exhausted
+    cursor: dict | None
+
+    @property
+    def segment(self) -> str:
+        return segment_key(self.partition, self.timezone)
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    cursor: dict | None = None
+    published: int = 0
+    failed: int = 0
+    done: bool = False
+
+
+def index_partitions() -> list[str]:
+    """
+    Partition keys of every ActiveSubscribersIndex shard, the priority
+    partition first. In migration mode the legacy unsharded "ACTIVE"
+    partition is included.
+    """
+    partitions = [PRIORITY_PARTITION]
+    partitions.extend(f"ACTIVE#{shard:02d}" for shard in range(PROFILE_SHARD_COUNT))
+    if PROFILE_SHARD_MIGRATION:
+        partitions.append(LEGACY_ACTIVE_PK)
+    return partitions
+
+
+# Set once the marker is seen; the backfill is never undone
+active_index_ready = False
+
+
+def active_partitions() -> list[str]:
+    """
+    The partitions a run reads its subscribers from: the index shards once
+    the ActiveSubscribersIndex backfill has completed, and until then the
+    priority partition followed by the profile shards and the legacy
+    PROFILE partition, which hold profiles not in the index yet.
+    """
+    global active_index_ready
+    if not active_index_ready:
+        response = dynamodb.get_item(
+            TableName=DYNAMO_TABLE, Key=ACTIVE_INDEX_MARKER_KEY, ProjectionExpression="PK"
+        )
+        active_index_ready = "Item" in response
+
+    if active_index_ready:
+        return index_partitions()
+
+    logger.warning("ActiveSubscribersIndex not backfilled yet, reading the profiles")
+    partitions = [PRIORITY_PARTITION]
+    partitions.extend(f"PROFILE#{shard:02d}" for shard in range(PROFILE_SHARD_COUNT))
+    partitions.append(LEGACY_PROFILE_PK)
+    return partitions
+
+
+def segment_key(partition: str, timezone: str) -> str:
+    """
+    One index shard restricted to one timezone bucket, the unit that is
+    queried, checkpointed and resumed.
+    """
+    return f"{partition}#{timezone}"
+
+
+def load_timezones() -> list[str]:
+    """
+    Returns every timezone registered by manage_subscriptions at ADD time,
+    plus the default bucket of profiles without one.
+    """
+    timezones = {DEFAULT_TIMEZONE}
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk",
+        "ExpressionAttributeValues": {":pk": {"S": "TIMEZONE"}},
+        "ProjectionExpression": "SK",
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        timezones.update(item["SK"]["S"] for item in response.get("Items", []))
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return sorted(timezones)
+
+
+def iter_subscriber_pages(
+    partition: str, timezone: str, start_key: dict | None = None
+):
+    """
+    Yields one SubscriberPage per Query page of one timezone bucket of one
+    shard of the sparse ActiveSubscribersIndex, starting after `start_key`
+    when resuming. Only active profiles exist in the index and it projects
+    keys only, so every item read is a subscriber we send to. A profile
+    partition is read from the table instead, as before the backfill.
+    """
+    if partition.startswith(LEGACY_PROFILE_PK):
+        yield from iter_profile_pages(partition, timezone, start_key)
+        return
+
+    prefix = f"{timezone}#"
+    last_evaluated_key = start_key
+
+    while True:
+        params = {
+            "TableName": DYNAMO_TABLE,
+            "IndexName": ACTIVE_INDEX,
+            "KeyConditionExpression": "activePK = :pk AND begins_with(activeSK, :tz)",
+            "ExpressionAttributeValues": {
+                ":pk": {"S": partition},
+                ":tz": {"S": prefix},
+            },
+            "ProjectionExpression": "activeSK",
+            "Limit": SUBSCRIBER_PAGE_SIZE,
+        }
+
+        if last_evaluated_key:
+            params["ExclusiveStartKey"] = last_evaluated_key
+
+        response = dynamodb.query(**params)
+        last_evaluated_key = response.get("LastEvaluatedKey")
+
+        yield SubscriberPage(
+            partition=partition,
+            timezone=timezone,
+            emails=[
+                item["activeSK"]["S"].removeprefix(prefix)
+                for item in response.get("Items", [])
+            ],
+            cursor=last_evaluated_key,
+        )
+
+        if not last_evaluated_key:
+            break
+
+
+def iter_profile_pages(partition: str, timezone: str, start_key: dict | None = None):
+    """
+    Yields one SubscriberPage per Query page of the active profiles of one
+    timezone bucket of a profile partition. Only read until every active
+    profile is in ActiveSubscribersIndex. Inactive profiles are read and
+    filtered out by DynamoDB.
+    """
+    if timezone == DEFAULT_TIMEZONE:
+        in_bucket = "(#tz = :tz OR attribute_not_exists(#tz))"
+    else:
+        in_bucket = "#tz = :tz"
+    last_evaluated_key = start_key
+
+    while True:
+        params = {
+            "TableName": DYNAMO_TABLE,
+            "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+            "FilterExpression": f"isActive = :active AND {in_bucket}",
+            "ExpressionAttributeNames": {"#tz": "timezone"},
+            "ExpressionAttributeValues": {
+                ":pk": {"S": partition},
+                ":sk": {"S": "PROFILE#"},
+                ":active": {"BOOL": True},
+                ":tz": {"S": timezone},
+            },
+            "ProjectionExpression": "SK",
+            "Limit": SUBSCRIBER_PAGE_SIZE,
+        }
+
+        if last_evaluated_key:
+            params["ExclusiveStartKey"] = last_evaluated_key
+
+        response = dynamodb.query(**params)
+        last_evaluated_key = response.get("LastEvaluatedKey")
+
+        yield SubscriberPage(
+            partition=partition,
+            timezone=timezone,
+            emails=[
+                item["SK"]["S"].removeprefix("PROFILE#")
+                for item in response.get("Items", [])
+            ],
+            cursor=last_evaluated_key,
+        )
+
+        if not last_evaluated_key:
+            break
+
+
+def load_checkpoints(run_id: str) -> dict[str, Checkpoint]:
+    """
+    Returns the saved checkpoint of every segment touched by the run.
+    """
+    checkpoints = {}
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+        "ExpressionAttributeValues": {
+            ":pk": {"S": f"RUN#{run_id}"},
+            ":sk": {"S": "CHECKPOINT#"},
+        },
+        "ConsistentRead": True,
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        for item in response.get("Items", []):
+            segment = item["SK"]["S"].removeprefix("CHECKPOINT#")
+            cursor = item.get("lastEvaluatedKey", {}).get("S")
+            checkpoints[segment] = Checkpoint(
+                cursor=json.loads(cursor) if cursor else None,
+                published=int(item.get("published", {}).get("N", "0")),
+                failed=int(item.get("failed", {}).get("N", "0")),
+                done=item.get("done", {}).get("BOOL", False),
+            )
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return checkpoints
+
+
+def save_checkpoint(
+    run_id: str,
+    page: SubscriberPage,
+    published: int,
+    failed: int,
+    advance: bool = True,
+):
+    """
+    Records that every job of `page` has been handled. A resumed run starts
+    the segment again right after this page. With `advance=False` only the
+    counts are added, and the page is read again.
+    """
+    expires_at = int(time.time()) + CHECKPOINT_TTL_DAYS * 86400
+    values = {
+        ":done": {"BOOL": page.cursor is None},
+        ":published": {"N": str(published)},
+        ":failed": {"N": str(failed)},
+        ":updated": {"S": datetime.now().isoformat()},
+        ":expires": {"N": str(expires_at)},
+    }
+
+    if not advance:
+        update = "SET updatedAt = :updated, expiresAt = :expires"
+        del values[":done"]
+    elif page.cursor is None:
+        update = "SET done = :done, updatedAt = :updated, expiresAt = :expires REMOVE lastEvaluatedKey"
+    else:
+        update = "SET done = :done, lastEvaluatedKey = :lek, updatedAt = :updated, expiresAt = :expires"
+        values[":lek"] = {"S": json.dumps(page.cursor)}
+
+    dynamodb.update_item(
+        TableName=DYNAMO_TABLE,
+        Key={
+            "PK": {"S": f"RUN#{run_id}"},
+            "SK": {"S": f"CHECKPOINT#{page.segment}"},
+        },
+        UpdateExpression=f"{update} ADD published :published, failed :failed",
+        ExpressionAttributeValues=values,
+    )
+
+
+def _run_summary_key(run_id: str) -> dict:
+    return {"PK": {"S": f"RUN#{run_id}"}, "SK": {"S": "SUMMARY"}}
+
+
+def create_run_summary(run_id: str, workers: int) -> bool:
+    """
+    Registers a planned run. Returns False if the run was already planned,
+    e.g. when the schedule delivers the same trigger twice.
+    """
+    expires_at = int(time.time()) + CHECKPOINT_TTL_DAYS * 86400
+    try:
+        dynamodb.put_item(
+            TableName=DYNAMO_TABLE,
+            Item={
+                **_run_summary_key(run_id),
+                "workers": {"N": str(workers)},
+                "workersRemaining": {"N": str(workers)},
+                "status": {"S": "RUNNING"},
+                "createdAt": {"S": datetime.now().isoformat()},
+                "expiresAt": {"N": str(expires_at)},
+            },
+            ConditionExpression="attribute_not_exists(PK)",
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def mark_worker_invoked(run_id: str, worker: int):
+    dynamodb.update_item(
+        TableName=DYNAMO_TABLE,
+        Key=_run_summary_key(run_id),
+        UpdateExpression="ADD invokedWorkers :worker_set",
+        ExpressionAttributeValues={":worker_set": {"NS": [str(worker)]}},
+    )
+
+
+def get_invoked_workers(run_id: str) -> set[int]:
+    """
+    The workers of a planned run that its planner has started so far.
+    """
+    response = dynamodb.get_item(
+        TableName=DYNAMO_TABLE,
+        Key=_run_summary_key(run_id),
+        ProjectionExpression="invokedWorkers",
+        ConsistentRead=True,
+    )
+    invoked = response.get("Item", {}).get("invokedWorkers", {}).get("NS", [])
+    return {int(worker) for worker in invoked}
+
+
+def finish_worker(run_id: str, worker: int) -> int | None:
+    """
+    Marks one worker of a planned run as finished and returns how many are
+    still running. Returns None if that worker was already counted.
+    """
+    try:
+        response = dynamodb.update_item(
+            TableName=DYNAMO_TABLE,
+            Key=_run_summary_key(run_id),
+            UpdateExpression="ADD workersRemaining :minus_one, finishedWorkers :worker_set",
+            ConditionExpression="NOT contains(finishedWorkers, :worker)",
+            ExpressionAttributeValues={
+                ":minus_one": {"N": "-1"},
+                ":worker_set": {"NS": [str(worker)]},
+                ":worker": {"N": str(worker)},
+            },
+            ReturnValues="UPDATED_NEW",
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return None
+    return int(response["Attributes"]["workersRemaining"]["N"])
+
+
+def complete_run_summary(run_id: str, published: int, failed: int):
+    dynamodb.update_item(
+        TableName=DYNAMO_TABLE,
+        Key=_run_summary_key(run_id),
+        UpdateExpression="SET #status = :status, published = :published, failed = :failed, completedAt = :completed",
+        ExpressionAttributeNames={"#status": "status"},
+        ExpressionAttributeValues={
+            ":status": {"S": "COMPLETE"},
+            ":published": {"N": str(published)},
+            ":failed": {"N": str(failed)},
+            ":completed": {"S": datetime.now().isoformat()},
+        },
+    )
+
+
+def _ledger_key(run_date: str, email: str, stage: str) -> dict:
+    return {"PK": {"S": f"LEDGER#{run_date}#{email}"}, "SK": {"S": stage}}
+
+
+def claim_ledger(run_date: str, email: str, stage: str = "DISPATCH") -> bool:
+    """
+    Marks `stage` of the run PENDING for the subscriber for
+    LEDGER_LEASE_SECONDS. Returns False if it is DONE, or PENDING under a
+    live lease, i.e. this is a duplicate trigger or delivery. A PENDING
+    claim whose lease ran out, e.g. because its holder timed out, is taken
+    over.
+    """
+    now = int(time.time())
+    try:
+        dynamodb.put_item(
+            TableName=DYNAMO_TABLE,
+            Item={
+                **_ledger_key(run_date, email, stage),
+                "status": {"S": "PENDING"},
+                "leaseUntil": {"N": str(now + LEDGER_LEASE_SECONDS)},
+                "createdAt": {"S": datetime.now().isoformat()},
+                "expiresAt": {"N": str(now + LEDGER_TTL_DAYS * 86400)},
+            },
+            ConditionExpression=(
+                "attribute_not_exists(PK) OR (#status = :pending AND leaseUntil < :now)"
+            ),
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":pending": {"S": "PENDING"},
+                ":now": {"N": str(now)},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def complete_ledgers(entries: list[tuple[str, str]], stage: str = "DISPATCH"):
+    """
+    Marks the claims of (runDate, email) pairs DONE once their work
+    succeeded, with BatchWriteItem. Only DONE claims stop a retry for good.
+    """
+    now = datetime.now().isoformat()
+    expires_at = str(int(time.time()) + LEDGER_TTL_DAYS * 86400)
+    writes = [
+        {
+            "PutRequest": {
+                "Item": {
+                    **_ledger_key(run_date, email, stage),
+                    "status": {"S": "DONE"},
+                    "completedAt": {"S": now},
+                    "expiresAt": {"N": expires_at},
+                }
+            }
+        }
+        for run_date, email in entries
+    ]
+
+    for start in range(0, len(writes), MAX_BATCH_WRITE):
+        pending = {DYNAMO_TABLE: writes[start : start + MAX_BATCH_WRITE]}
+        while pending:
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get("UnprocessedItems")
+
+
+def release_ledger(run_date: str, email: str, stage: str = "DISPATCH"):
+    """
+    Removes a claim whose work failed, so a retry can do it again.
+    """
+    dynamodb.delete_item(
+        TableName=DYNAMO_TABLE, Key=_ledger_key(run_date, email, stage)
+    )
+
+
+def claim_jobs(jobs: list[dict]) -> list[dict]:
+    """
+    Claims the dispatch ledger entry of every job concurrently and returns
+    only the jobs that were not dispatched before in their run.
+    """
+    claims = executor.map(
+        lambda job: claim_ledger(job["runDate"], job["email"]), jobs
+    )
+    return [job for job, claimed in zip(jobs, claims) if claimed]
+
+
+def deserialize_item(item):
+    return {k: list(v.values())[0] for k, v in item.items()}
+
+
+def iter_location_pages():
+    """
+    Yields pages of the LOCATION registry maintained by add_city, one list
+    of {"key", "city", "state", "lat", "lon", "timezone", "subscriberTimezones"}
+    per Query page. subscriberTimezones is empty for locations written before
+    add_city recorded it.
+    """
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk",
+        "ExpressionAttributeValues": {":pk": {"S": "LOCATION"}},
+        "Limit": LOCATION_PAGE_SIZE,
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+
+        locations = []
+        for item in response.get("Items", []):
+            location = deserialize_item(item)
+            locations.append(
+                {
+                    "key": location["SK"],
+                    "city": location.get("city"),
+                    "state": location.get("state"),
+                    "lat": float(location["lat"]),
+                    "lon": float(location["lon"]),
+                    "timezone": location.get("timezone"),
+                    "subscriberTimezones": set(location.get("subscriberTimezones", ())),
+                }
+            )
+        yield locations
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_location_subscribers(location_key: str) -> list[str]:
+    """
+    Returns every email with a subscription to the location, read from its
+    reverse index items (PK=LOC#..., SK=SUB#<email>).
+    """
+    emails = []
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk)",
+        "ExpressionAttributeValues": {
+            ":pk": {"S": location_key},
+            ":sk": {"S": "SUB#"},
+        },
+        "ProjectionExpression": "SK",
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+        emails.extend(
+            item["SK"]["S"].removeprefix("SUB#") for item in response.get("Items", [])
+        )
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return emails
+
+
+def subscription_partitions() -> list[str]:
+    """
+    Partition keys of every SubscriptionIndex shard.
+    """
+    return [f"SUBS#{shard:02d}" for shard in range(PROFILE_SHARD_COUNT)]
+
+
+def iter_subscription_pages(partition: str):
+    """
+    Yields pages of one SubscriptionIndex shard, which holds nothing but
+    subscription items, one list of (email, {"city", "state", "lat", "lon",
+    "timezone"}) pairs per page.
+    """
+    params = {
+        "TableName": DYNAMO_TABLE,
+        "IndexName": SUBSCRIPTION_INDEX,
+        "KeyConditionExpression": "subsPK = :pk",
+        "ProjectionExpression": "PK, city, #state, lat, lon, #tz",
+        "ExpressionAttributeNames": {"#state": "state", "#tz": "timezone"},
+        "ExpressionAttributeValues": {":pk": {"S": partition}},
+    }
+
+    while True:
+        response = dynamodb.query(**params)
+
+        subscriptions = []
+        for item in response.get("Items", []):
+            sub = deserialize_item(item)
+            subscriptions.append(
+                (
+                    sub["PK"].removeprefix("SUBSCRIPTION#"),
+                    {
+                        "city": sub.get("city"),
+                        "state": sub.get("state"),
+                        "lat": float(sub["lat"]),
+                        "lon": float(sub["lon"]),
+                        "timezone": sub.get("timezone"),
+                    },
+                )
+            )
+        yield subscriptions
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
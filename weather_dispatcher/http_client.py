@@ -0,0 +1,185 @@
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import circuit_breaker
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+# Base of the exponential backoff between retries, in seconds
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", "0.5"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+
+# No attempt of a call with a deadline is started with less time left
+HTTP_MIN_ATTEMPT_SECONDS = 0.5
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def create_session(retries: int = HTTP_RETRIES) -> requests.Session:
+    """
+    A session with a keep-alive connection pool and retries with jittered
+    exponential backoff on connection errors, 429 and 5xx. A Retry-After
+    header from the server is honoured.
+    """
+    retry = Retry(
+        total=retries,
+        # Without retries a timeout is raised as itself, not as exhausted retries
+        connect=None if retries else False,
+        read=None if retries else False,
+        backoff_factor=HTTP_BACKOFF,
+        backoff_jitter=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class LatencyStats:
+    __slots__ = ("requests", "total_ms", "max_ms", "lock")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.total_ms = 0.0
+            self.max_ms = 0.0
+
+    def record(self, ms: float):
+        with self.lock:
+            self.requests += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            average = self.total_ms / self.requests if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "avg_ms": round(average, 1),
+                "max_ms": round(self.max_ms, 1),
+            }
+
+
+# Shared by every call and kept across warm invocations, so connections
+# and their TLS sessions are reused
+session = create_session()
+# Calls with a deadline retry in get() instead, only while the time allows
+deadline_session = create_session(retries=0)
+# Reset by each handler when it starts, so its summary covers one invocation
+stats = LatencyStats()
+
+
+def get(
+    url: str, params: dict | None = None, timeout=None, until: float | None = None
+) -> requests.Response:
+    """
+    GETs `url` through the shared pool, retrying as set up above. Logs the
+    latency of the request, retries included, and raises for an error
+    status that is left after the retries.
+
+    With `until`, a time.monotonic() value, the whole call ends by then:
+    each attempt's timeouts are cut to the time left, and an attempt is
+    retried only while the backoff and another attempt still fit.
+
+    Calls go through the circuit breaker of the endpoint. While it is open
+    they raise CircuitOpenError right away. Connection errors, 429 and 5xx
+    count against the endpoint, other client errors do not. Neither does a
+    timeout that was cut short by `until`, since that is the caller's
+    deadline and not the endpoint being slow.
+    """
+    parts = urlsplit(url)
+    endpoint = circuit_breaker.breaker(f"{parts.netloc}{parts.path}")
+    endpoint.before_call()
+
+    started = time.perf_counter()
+    if until is None:
+        try:
+            response = session.get(
+                url,
+                params=params,
+                timeout=timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+            )
+        except requests.RequestException:
+            endpoint.record_failure()
+            raise
+    else:
+        response = get_until(url, params, timeout, until, endpoint)
+    ms = (time.perf_counter() - started) * 1000
+    stats.record(ms)
+    logger.info(f"GET {parts.netloc} {response.status_code} in {ms:.0f} ms")
+
+    if response.status_code in RETRY_STATUSES:
+        endpoint.record_failure()
+    else:
+        endpoint.record_success()
+
+    response.raise_for_status()
+    return response
+
+
+def get_until(
+    url: str, params: dict | None, timeout, until: float, endpoint
+) -> requests.Response:
+    """
+    The attempts of a get() that has to end by `until`, with the same
+    backoff and statuses as the session's retries. Returns the last
+    response; raises the last error, recorded against the endpoint unless
+    the deadline cut it short.
+    """
+    connect, read = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    attempt = 0
+    while True:
+        left = until - time.monotonic()
+        if left < HTTP_MIN_ATTEMPT_SECONDS:
+            endpoint.record_abandoned()
+            raise requests.Timeout(f"No time left to call {urlsplit(url).netloc}")
+
+        try:
+            response = deadline_session.get(
+                url, params=params, timeout=(min(connect, left), min(read, left))
+            )
+        except requests.RequestException as e:
+            limit = connect if isinstance(e, requests.ConnectTimeout) else read
+            if isinstance(e, requests.Timeout) and left < limit:
+                endpoint.record_abandoned()
+                raise
+            error, response = e, None
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            error = None
+
+        backoff = HTTP_BACKOFF * 2**attempt + random.uniform(0, HTTP_BACKOFF)
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            backoff = max(backoff, float(response.headers["Retry-After"]))
+        attempt += 1
+        retry = attempt <= HTTP_RETRIES and (
+            time.monotonic() + backoff + HTTP_MIN_ATTEMPT_SECONDS < until
+        )
+        if not retry:
+            if error is None:
+                return response
+            endpoint.record_failure()
+            raise error
+        time.sleep(backoff)
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Share of the SES MaxSendRate the dispatcher paces to; 0 disables it
+SES_RATE_HEADROOM = float(os.environ.get("DISPATCH_SES_RATE_HEADROOM", "0.9"))
+# Open-Meteo requests per minute the senders may make; 0 disables it
+OPEN_METEO_RPM = int(os.environ.get("OPEN_METEO_RPM", "0"))
+
+ses = boto3.client("ses")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second and
+    holding at most `capacity`. acquire() blocks until the tokens are
+    available, so callers never run ahead of the rate.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "lock")
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float) -> float:
+        """
+        The seconds acquire(tokens) would wait right now.
+        """
+        with self.lock:
+            self._refill()
+            missing = tokens - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Takes `tokens` and returns the seconds waited. A request larger than
+        the bucket takes what is there and waits out the rest.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        # The tokens are already reserved, so later callers queue behind
+        # this one without the lock being held while it sleeps
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def ses_send_rate() -> float | None:
+    """
+    The account's SES MaxSendRate in emails per second, or None if it
+    cannot be read.
+    """
+    try:
+        return float(ses.get_send_quota()["MaxSendRate"])
+    except Exception:
+        logger.exception("Could not read the SES send quota, not pacing sends")
+        return None
+
+
+class Pacer:
+    """
+    Paces publishing to stay just under the downstream limits: one SES
+    token per subscriber and one Open-Meteo token per job whose senders
+    still need to fetch the weather. Every invocation paces on its own, so
+    when `shares` invocations dispatch at once each gets that share of the
+    rates.
+    """
+
+    def __init__(self):
+        self.ses = None
+        self.weather = None
+        self.shares = 1
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def set_shares(self, shares: int):
+        """
+        Splits the rates across `shares` concurrent dispatch invocations.
+        """
+        shares = max(int(shares), 1)
+        with self.lock:
+            if shares != self.shares:
+                self.shares = shares
+                self.ready = False
+
+    def setup(self):
+        with self.lock:
+            if self.ready:
+                return
+            self.ses = self.weather = None
+            if SES_RATE_HEADROOM > 0:
+                rate = ses_send_rate()
+                if rate:
+                    self.ses = TokenBucket(rate * SES_RATE_HEADROOM / self.shares)
+                    logger.info(
+                        f"Pacing sends to {self.ses.rate:.1f}/s "
+                        f"(1/{self.shares} of the run)"
+                    )
+            if OPEN_METEO_RPM > 0:
+                self.weather = TokenBucket(OPEN_METEO_RPM / 60 / self.shares)
+                logger.info(
+                    f"Pacing weather fetches to {self.weather.rate * 60:.0f}/min "
+                    f"(1/{self.shares} of the run)"
+                )
+            self.ready = True
+
+    def active(self) -> bool:
+        self.setup()
+        return bool(self.ses or self.weather)
+
+    def delay(self, subscribers: int, fetches: int) -> float:
+        """
+        Seconds that publishing `subscribers` in `fetches` weather-needing
+        jobs would wait for tokens right now.
+        """
+        self.setup()
+        waits = [0.0]
+        if self.ses:
+            waits.append(self.ses.wait_time(subscribers))
+        if self.weather and fetches:
+            waits.append(self.weather.wait_time(fetches))
+        return max(waits)
+
+    def acquire_jobs(self, jobs: list[dict], subscribers: int):
+        self.setup()
+        if self.ses:
+            self.ses.acquire(subscribers)
+        if self.weather:
+            fetches = sum(1 for job in jobs if needs_weather(job))
+            if fetches:
+                self.weather.acquire(fetches)
+
+    def acquire_weather(self, fetches: int = 1):
+        self.setup()
+        if self.weather:
+            self.weather.acquire(fetches)
+
+
+def needs_weather(job: dict) -> bool:
+    return not job.get("cities") or any(
+        "forecast" not in city for city in job["cities"]
+    )
+
+
+# Shared by the publishing threads and kept across warm invocations
+pacer = Pacer()
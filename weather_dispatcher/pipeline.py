@@ -0,0 +1,83 @@
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PREFETCH_PAGES = int(os.environ.get("DISPATCH_PREFETCH_PAGES", "2"))
+# Iterables read at the same time; the others wait for a free producer
+PREFETCH_PRODUCERS = int(os.environ.get("DISPATCH_PREFETCH_PRODUCERS", "8"))
+
+_DONE = object()
+
+
+class _ProducerError:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def merge(iterables, depth: int = PREFETCH_PAGES, producers: int = PREFETCH_PRODUCERS):
+    """
+    Iterates the iterables on at most `producers` background threads and
+    yields their items through one bounded queue, so the next items are
+    produced while the caller works on the current one. A thread reads one
+    iterable to its end before it takes the next. Items from the same
+    iterable keep their order. At most `depth` items are buffered at any time.
+    """
+    iterables = list(iterables)
+    pending = queue.SimpleQueue()
+    for iterable in iterables:
+        pending.put(iterable)
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        while not stop.is_set():
+            try:
+                iterable = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                for item in iterable:
+                    if not put(item):
+                        return
+            except BaseException as e:
+                put(_ProducerError(e))
+                return
+            if not put(_DONE):
+                return
+
+    threads = [
+        threading.Thread(target=produce, name="prefetch", daemon=True)
+        for _ in range(min(max(producers, 1), len(iterables)))
+    ]
+    for thread in threads:
+        thread.start()
+
+    remaining = len(iterables)
+    try:
+        while remaining:
+            item = buffer.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=1)
@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client("s3")
+SNAPSHOT_BUCKET = os.environ.get("SNAPSHOT_BUCKET")
+SNAPSHOT_KEY = os.environ.get("SNAPSHOT_KEY", "subscribers.ndjson")
+# Jobs left by a handed-over run, expired by the bucket's lifecycle rule
+RUN_JOBS_PREFIX = "runs/"
+
+
+def open_snapshot(version_id: str | None = None):
+    """
+    Opens the subscriber snapshot kept by SubscriberSnapshotFunction with
+    a single GET, the given version of it if `version_id` is set. Returns
+    the VersionId read and an iterator streaming one subscriber record per
+    line, after logging the header line.
+    """
+    params = {"Bucket": SNAPSHOT_BUCKET, "Key": SNAPSHOT_KEY}
+    if version_id:
+        params["VersionId"] = version_id
+    response = s3.get_object(**params)
+    lines = response["Body"].iter_lines()
+
+    header = json.loads(next(lines, b"{}") or b"{}")
+    logger.info(f"Reading subscriber snapshot version {header.get('version')}")
+
+    records = (json.loads(line) for line in lines if line)
+    return response.get("VersionId"), records
+
+
+def save_run_jobs(run_id: str, jobs: list[dict]) -> str:
+    """
+    Stores the jobs a handed-over run still has to publish, one per line,
+    and returns their key. The resumed invocation reads them back instead
+    of walking the table and fetching the weather again.
+    """
+    key = f"{RUN_JOBS_PREFIX}{run_id}.ndjson"
+    body = "\n".join(json.dumps(job, separators=(",", ":")) for job in jobs)
+    s3.put_object(Bucket=SNAPSHOT_BUCKET, Key=key, Body=body.encode())
+    return key
+
+
+def iter_run_jobs(key: str):
+    """
+    Yields the jobs stored by save_run_jobs.
+    """
+    response = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=key)
+    for line in response["Body"].iter_lines():
+        if line:
+            yield json.loads(line)
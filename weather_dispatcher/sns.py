@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+import boto3
+from botocore.config import Config
+import pacing
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SNS_TOPIC_ARN = os.environ["WEATHER_FANOUT_TOPIC"]
+# Lane of high-priority subscribers, served by its own reserved senders
+PRIORITY_TOPIC_ARN = os.environ.get("WEATHER_PRIORITY_TOPIC") or SNS_TOPIC_ARN
+PUBLISH_WORKERS = int(os.environ.get("DISPATCH_PUBLISH_WORKERS", "8"))
+# Subscribers packed into one message; 1 keeps the single-email job format
+ENVELOPE_SIZE = int(os.environ.get("DISPATCH_ENVELOPE_SIZE", "1"))
+
+# SNS PublishBatch accepts at most 10 entries per request, and both a single
+# message and the whole batch are limited to 256 KB
+MAX_BATCH_ENTRIES = 10
+MAX_PAYLOAD_BYTES = 256 * 1024
+
+sns = boto3.client(
+    "sns", config=Config(max_pool_connections=max(PUBLISH_WORKERS, 10))
+)
+# Shared across pages and warm invocations
+executor = ThreadPoolExecutor(max_workers=PUBLISH_WORKERS)
+
+
+@dataclass(slots=True)
+class PublishStats:
+    # Counted in subscribers, so envelopes and single jobs add up the same way
+    published: int = 0
+    retried: int = 0
+    failed: int = 0
+    failed_jobs: list[dict] = field(default_factory=list)
+
+    def merge(self, other: "PublishStats"):
+        self.published += other.published
+        self.retried += other.retried
+        self.failed += other.failed
+        self.failed_jobs.extend(other.failed_jobs)
+
+
+def job_emails(job: dict) -> list[str]:
+    if "subscribers" in job:
+        return job["subscribers"]
+    return [job["email"]]
+
+
+def pack_envelopes(jobs: list[dict], size: int = ENVELOPE_SIZE) -> list[dict]:
+    """
+    Packs single-subscriber jobs into envelopes of up to `size` subscribers
+    sharing a runDate, each kept under the SNS message size limit. Jobs that
+    already carry their cities are published as they are.
+    """
+    if size <= 1:
+        return jobs
+
+    envelopes = []
+    by_run_date = {}
+    for job in jobs:
+        if "cities" in job:
+            envelopes.append(job)
+        else:
+            by_run_date.setdefault(job["runDate"], []).append(job["email"])
+
+    for run_date, emails in by_run_date.items():
+        base_bytes = len(json.dumps({"runDate": run_date, "subscribers": []}))
+        current, current_bytes = [], base_bytes
+        for email in emails:
+            email_bytes = len(json.dumps(email).encode("utf-8")) + 2
+            if current and (
+                len(current) >= size or current_bytes + email_bytes > MAX_PAYLOAD_BYTES
+            ):
+                envelopes.append({"runDate": run_date, "subscribers": current})
+                current, current_bytes = [], base_bytes
+            current.append(email)
+            current_bytes += email_bytes
+        if current:
+            envelopes.append({"runDate": run_date, "subscribers": current})
+
+    return envelopes
+
+
+def chunk_messages(messages: list[tuple[dict, str]]):
+    """
+    Groups (job, message) pairs into PublishBatch requests of at most 10
+    entries and 256 KB in total.
+    """
+    batch, batch_bytes = [], 0
+    for job, message in messages:
+        message_bytes = len(message.encode("utf-8"))
+        if batch and (
+            len(batch) >= MAX_BATCH_ENTRIES
+            or batch_bytes + message_bytes > MAX_PAYLOAD_BYTES
+        ):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append((job, message))
+        batch_bytes += message_bytes
+    if batch:
+        yield batch
+
+
+def publish_single(job: dict, message: str, topic_arn: str = SNS_TOPIC_ARN) -> bool:
+    try:
+        sns.publish(TopicArn=topic_arn, Message=message)
+        return True
+    except Exception:
+        logger.exception(f"Failed to dispatch weather job for {job_emails(job)}")
+        return False
+
+
+def publish_batch(
+    batch: list[tuple[dict, str]], topic_arn: str = SNS_TOPIC_ARN
+) -> PublishStats:
+    """
+    Publishes up to 10 jobs with one PublishBatch call once the pacer lets
+    them through. Entries reported as failed are retried one by one with
+    Publish.
+    """
+    stats = PublishStats()
+    entries = [
+        {"Id": str(idx), "Message": message} for idx, (_, message) in enumerate(batch)
+    ]
+
+    jobs = [job for job, _ in batch]
+    pacing.pacer.acquire_jobs(jobs, sum(len(job_emails(job)) for job in jobs))
+
+    try:
+        response = sns.publish_batch(
+            TopicArn=topic_arn, PublishBatchRequestEntries=entries
+        )
+        failed_ids = [int(f["Id"]) for f in response.get("Failed", [])]
+        for success in response.get("Successful", []):
+            stats.published += len(job_emails(batch[int(success["Id"])][0]))
+    except Exception as e:
+        logger.exception(f"PublishBatch failed for {len(batch)} jobs: {e}")
+        failed_ids = list(range(len(batch)))
+
+    for idx in failed_ids:
+        job, message = batch[idx]
+        subscribers = len(job_emails(job))
+        if publish_single(job, message, topic_arn):
+            stats.published += subscribers
+            stats.retried += subscribers
+        else:
+            stats.failed += subscribers
+            stats.failed_jobs.append(job)
+
+    return stats
+
+
+def publish_jobs(jobs: list[dict]) -> PublishStats:
+    """
+    Packs jobs into envelopes when DISPATCH_ENVELOPE_SIZE > 1 and publishes
+    them in batches of 10 from a bounded pool of concurrent workers.
+    High-priority jobs go out first, on their own topic.
+    """
+    stats = PublishStats()
+    lanes = [
+        ([job for job in jobs if job.get("priority")], PRIORITY_TOPIC_ARN),
+        ([job for job in jobs if not job.get("priority")], SNS_TOPIC_ARN),
+    ]
+    for lane_jobs, topic_arn in lanes:
+        messages = [(job, json.dumps(job)) for job in pack_envelopes(lane_jobs)]
+        publish = partial(publish_batch, topic_arn=topic_arn)
+        for batch_stats in executor.map(publish, chunk_messages(messages)):
+            stats.merge(batch_stats)
+
+    return stats
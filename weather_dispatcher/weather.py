@@ -0,0 +1,176 @@
+import logging
+import os
+import circuit_breaker
+import http_client
+from concurrent.futures import ThreadPoolExecutor
+from daily_forecast import EMPTY_FORECAST, Forecast
+
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Cities per multi-city request, and a cap on the length of its coordinates
+WEATHER_CHUNK_CITIES = int(os.environ.get("WEATHER_CHUNK_CITIES", "50"))
+WEATHER_MAX_URL_CHARS = int(os.environ.get("WEATHER_MAX_URL_CHARS", "3000"))
+WEATHER_FETCH_WORKERS = int(os.environ.get("WEATHER_FETCH_WORKERS", "4"))
+
+# Fetches the chunks of a payload concurrently, kept across warm invocations
+fetch_executor = ThreadPoolExecutor(max_workers=WEATHER_FETCH_WORKERS)
+
+
+def fetch_weather(lat: float, lon: float) -> Forecast:
+    url = "https://api.open-meteo.com/v1/forecast"
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "daily": "temperature_2m_max,temperature_2m_min,weathercode",
+        "temperature_unit": "fahrenheit",
+        "windspeed_unit": "mph",
+        "precipitation_unit": "inch",
+        "timezone": "auto",
+    }
+
+    response = http_client.get(url, params=params)
+    return Forecast.from_daily(response.json().get("daily", {}))
+
+
+def fetch_multi_city_weather(cities):
+    lats = ",".join(str(city.get("lat")) for city in cities)
+    lons = ",".join(str(city.get("lon")) for city in cities)
+
+    url = "https://api.open-meteo.com/v1/forecast"
+    params = {
+        "latitude": lats,
+        "longitude": lons,
+        "daily": "temperature_2m_max,temperature_2m_min,weathercode",
+        "temperature_unit": "fahrenheit",
+        "windspeed_unit": "mph",
+        "precipitation_unit": "inch",
+        "timezone": "auto",
+    }
+
+    response = http_client.get(url, params=params)
+    data = response.json()
+
+    if not isinstance(data, list):
+        raise ValueError("Expected list response from weather API")
+
+    return data
+
+
+def chunk_cities(cities: list[dict]):
+    """
+    Splits cities into multi-city requests of at most WEATHER_CHUNK_CITIES
+    cities whose coordinate lists stay under WEATHER_MAX_URL_CHARS.
+    """
+    chunk, chars = [], 0
+    for city in cities:
+        city_chars = len(str(city.get("lat"))) + len(str(city.get("lon"))) + 2
+        if chunk and (
+            len(chunk) >= WEATHER_CHUNK_CITIES or chars + city_chars > WEATHER_MAX_URL_CHARS
+        ):
+            yield chunk
+            chunk, chars = [], 0
+        chunk.append(city)
+        chars += city_chars
+    if chunk:
+        yield chunk
+
+
+def fetch_chunk(cities: list[dict]) -> list[Forecast]:
+    """
+    Fetches the forecasts of one chunk with a single request. Raises if the
+    request fails; a city whose result cannot be normalized gets an empty
+    forecast.
+    """
+    # A single coordinate gets an object back, not a list
+    if len(cities) == 1:
+        return [fetch_weather(cities[0]["lat"], cities[0]["lon"])]
+
+    forecasts = []
+    for city, result in zip(cities, fetch_multi_city_weather(cities)):
+        try:
+            forecasts.append(Forecast.from_daily(result.get("daily", {})))
+        except Exception as e:
+            logger.exception(
+                f"Failed to normalize weather for {city.get('city')}, "
+                f"{city.get('state')}: {e}"
+            )
+            forecasts.append(EMPTY_FORECAST)
+    return forecasts
+
+
+def fetch_isolated(cities: list[dict]) -> list[Forecast]:
+    """
+    Fetches a chunk, and if that fails, bisects it and fetches both halves
+    concurrently until the failing cities are isolated. A bad coordinate
+    costs about 2 * log2(n) extra requests, not n.
+    """
+    try:
+        return fetch_chunk(cities)
+    except circuit_breaker.CircuitOpenError as e:
+        # Bisecting cannot help while the endpoint itself is down
+        logger.warning(f"Skipping weather for {len(cities)} cities: {e}")
+        return [EMPTY_FORECAST for _ in cities]
+    except Exception as e:
+        if len(cities) == 1:
+            city = cities[0]
+            logger.exception(
+                f"Failed to fetch weather for {city.get('city')}, {city.get('state')}"
+            )
+            return [EMPTY_FORECAST]
+        logger.warning(f"Weather fetch failed for {len(cities)} cities, bisecting: {e}")
+
+    middle = len(cities) // 2
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        left, right = pool.map(fetch_isolated, [cities[:middle], cities[middle:]])
+    return left + right
+
+
+def build_forecast_payload(cities: list[dict]):
+    """
+        Build a forecast payload for a list of cities.
+
+        :param cities: Subscriber cities
+        :type cities: list[dict]
+        :example: [{"city": "Charlotte", "state": "NC", "lat": 35.22709, "lon": -80.84313}]
+
+        :return: Forecast payload
+        :rtype: list[dict]
+        :example: [
+        {
+            "city": "Charlotte",
+            "state": "NC",
+            "country": "US",
+            "forecast": Forecast(
+                dates=["2025-12-29", ...],
+                highs=[61.9, ...],
+                lows=[53.4, ...],
+                codes=[3, ...],
+            ),
+        },
+        {
+            "city": "Huntersville",
+            "state": "NC",
+            "country": "US",
+            "forecast": Forecast(...),
+        },
+    ]
+    """
+
+    if not cities:
+        return []
+
+    # Chunks are fetched concurrently; each one isolates its own failures
+    forecasts = []
+    for chunk_forecasts in fetch_executor.map(fetch_isolated, list(chunk_cities(cities))):
+        forecasts.extend(chunk_forecasts)
+
+    return [
+        {
+            "city": city.get("city"),
+            "state": city.get("state"),
+            "forecast": forecast,
+        }
+        for city, forecast in zip(cities, forecasts)
+    ]